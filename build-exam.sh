@@ -3,23 +3,17 @@
 # Take an exam base name and build all of the exam and solution files.
 # The input files should be in the current directory, and the output
 # files will be written to the current directory.  This takes one
-# argument which is the exam base name
+# argument which is the exam base name, and an optional number of
+# parallel jobs.
 #
 # Example:
 #
 #   build-exam.sh aSampleBaseName
 #
+# The PDF files are built by "exam-writer.py --pdf" using the pickle
+# file, and only the PDF files that are out of date are rebuilt.  The
+# existing LaTeX files are compiled as they are (so they can be edited
+# by hand), and the answer keys are not rewritten.
+#
 
-for file in ${1}-????.tex; do
-    base=$(echo ${file} | sed s:.tex::)
-    pdf="${base}.pdf"
-    soln="${base}-soln.pdf"
-    pdflatex -halt-on-error "\def\printSolutions{}\input{${file}}" && \
-        pdflatex "\def\printSolutions{}\input{${file}}" && \
-        mv ${pdf} ${soln} && \
-        rm *.aux *.log
-    pdflatex -halt-on-error "${file}" && \
-        pdflatex "${file}" && \
-        rm *.aux *.log
-done
-            
+exec python3 $(dirname ${0})/exam-writer.py --pdf -j ${2:-1} -P ${1}.pickle
@@ -1,43 +1,141 @@
 #!/usr/bin/env python3
 
 import csv
+import array
+import collections
+import functools
 import string
 import argparse
 import os.path
 import sys
 import io
+import re
+import json
+import math
+import hashlib
+import tempfile
+import multiprocessing
 
 parser = argparse.ArgumentParser(
     description="Grade an exam read from the scantron sheets")
-parser.add_argument("roster",nargs=1,action="store",
+parser.add_argument("roster",nargs="?",action="store",
                     help="The roster downloaded from blackboard or brightspace (CSV)")
-parser.add_argument("key",nargs=1,action="store",
+parser.add_argument("key",nargs="?",action="store",
                     help="The key produced by exam-writer (CSV)")
-parser.add_argument("answers",nargs=1,action="store",
+parser.add_argument("answers",nargs="?",action="store",
                     help="The exam answers returned from opscan (CSV)")
-parser.add_argument("results",nargs=1,action="store",
+parser.add_argument("results",nargs="?",action="store",
                     help="The output file with a score for each student (CSV)")
+parser.add_argument("--choices",action="store",default=None,
+                    help="The answer choices produced by exam-writer (default is next to the key)")
+parser.add_argument("--report",action="store",default=None,
+                    help="Write an item analysis of the questions (CSV, or JSON for a .json file)")
+parser.add_argument("--regrade",action="store_true",default=False,
+                    help="Replace existing results, and only rescore the students whose answers or key changed")
+parser.add_argument("--reconcile",action="store_true",default=False,
+                    help="Grade the proposed matches between unmatched scans and roster students")
+parser.add_argument("-m","--manifest",action="store",default=None,
+                    help="Grade every exam listed in a manifest (CSV with Roster, Key, Answers, Results, and optional Report and Choices columns)")
+parser.add_argument("-j","--jobs",action="store",default=1,type=int,
+                    help="Grade the manifest exams using JOBS processes")
 options = parser.parse_args()
+if options.manifest is None and options.results is None:
+    parser.error("the roster, key, answers and results are required")
+
+###########################################################3
+# Normalize a student name so that differences in case, spacing and
+# punctuation don't matter when the names are compared.
+def NormalizeName(lastname,firstname):
+    def Normalize(name):
+        return "".join(c for c in str(name).upper() if c.isalnum())
+    return (Normalize(lastname), Normalize(firstname))
+
+###########################################################3
+# A list of student records with "LASTNAME", "FIRSTNAME" and "SID"
+# fields that is indexed by the SID, and by the normalized name for
+# records with a mistyped SID.  Duplicate SIDs are reported as the
+# records are added (the first record is used), and the records that
+# are never found can be reported at the end.
+class StudentRecords:
+    def __init__(self,kind):
+        self.kind = kind
+        self.student = list()
+        self.bySID = dict()
+        self.byName = dict()
+        self.found = set()
+        self.duplicates = 0
+
+    # Forget which records were found (so the records can be reused).
+    def Reset(self):
+        self.found = set()
+
+    def AddStudent(self,out):
+        self.student.append(out)
+        sid = out["SID"].strip()
+        if sid in self.bySID:
+            print("Duplicate", self.kind, "for", sid,
+                  out["LASTNAME"], out["FIRSTNAME"])
+            self.duplicates = self.duplicates + 1
+        else:
+            self.bySID[sid] = out
+        name = NormalizeName(out["LASTNAME"],out["FIRSTNAME"])
+        self.byName.setdefault(name,list()).append(out)
+
+    # Find the record for a student.  The SID is tried first, and then
+    # the name (but only if a single record has that name).
+    def FindStudent(self,sid,lastname,firstname):
+        v = self.FindBySID(sid)
+        if v is None: v = self.FindByName(sid,lastname,firstname)
+        return v
+
+    # Find the record with the SID.
+    def FindBySID(self,sid):
+        v = self.bySID.get(sid.strip())
+        if v is not None: self.found.add(id(v))
+        return v
+
+    # Find the record with the name (but only if a single record has
+    # that name).  The mistyped SID is only used for the message.
+    def FindByName(self,sid,lastname,firstname):
+        names = self.byName.get(NormalizeName(lastname,firstname),[])
+        if len(names) != 1: return None
+        v = names[0]
+        print("Matched", self.kind, "by name",
+              lastname, firstname, sid, "using", v["SID"])
+        self.found.add(id(v))
+        return v
+
+    # Print and return the records that were never found.
+    def ReportUnmatched(self):
+        unmatched = [v for v in self.student if id(v) not in self.found]
+        for v in unmatched:
+            print("Unmatched", self.kind, v["SID"],
+                  v["LASTNAME"], v["FIRSTNAME"])
+        print("Unmatched", self.kind, len(unmatched),
+              "and duplicate", self.kind, self.duplicates)
+        return unmatched
 
 ###########################################################3
 # Read a Black Board roster and fill a dictionary with "LASTNAME",
-# "FIRSTNAME", and "SID" (student identification number).  This also
-# saves a copy of the roster so that the output results can be added.
-# The roster should be downloaded so that the last column is empty and
+# "FIRSTNAME", and "SID" (student identification number).  The roster
+# row is saved in "Row" so that the output results can be added.  The
+# roster should be downloaded so that the last column is empty and
 # will hold the score.
-class ExamRoster:
+class ExamRoster(StudentRecords):
     def __init__(self):
-        self.student = list()
-        self.roster = list()
-        
+        StudentRecords.__init__(self,"roster")
+        self.fields = list()
+
     def ReadFile(self,rosterFile):
         try:
             with io.open(rosterFile,"r",encoding="ascii",errors="ignore") as f:
                 reader = csv.DictReader(f)
+                self.fields = list(reader.fieldnames)
                 count = 0
                 for v in reader:
                     ## Create the output list (elements are over-written)
                     out = dict()
+                    out["Row"] = v
                     for k in v:
                         if "Last Name" in k: out["LASTNAME"] = v[k]
                         if "First Name" in k: out["FIRSTNAME"] = v[k]
@@ -47,8 +145,7 @@ class ExamRoster:
                         if "OrgDefinedId" in k: out["SID"] = v[k]
                     print("ROSTER ", out["LASTNAME"], out["FIRSTNAME"], out["SID"])
                     count = count+1
-                    self.student.append(out)
-                    self.roster.append(v)
+                    self.AddStudent(out)
                 print("Students on roster",count)
         except:
             print ("Problem reading roster")
@@ -58,10 +155,10 @@ class ExamRoster:
 # Read an answer key from exam-writer.py and fill a dictionary with
 # "LASTNAME", "FIRSTNAME", "SID" (student identification number), and
 # a list with the expected answers for the student.
-class ExamKey:
+class ExamKey(StudentRecords):
     def __init__(self):
-        self.student = list()
-        
+        StudentRecords.__init__(self,"key")
+
     def ReadFile(self,keyFile):
         try:
             print(keyFile)
@@ -73,147 +170,838 @@ class ExamKey:
                     out["LASTNAME"] = v["LASTNAME"]
                     out["FIRSTNAME"] = v["FIRSTNAME"]
                     out["SID"] = v["SID"]
+                    out["Basename"] = v.get("Basename")
                     out["Answers"] = v["Answers"].split(';')
                     out["QuestionNames"] = v["QuestionNames"].split(';')
+                    out["Matcher"] = CompileKey(out["Answers"],
+                                                out["QuestionNames"])
                     print("KEYS ", out["LASTNAME"], out["FIRSTNAME"], out["SID"])
                     count = count + 1
-                    self.student.append(out)
+                    self.AddStudent(out)
                 print("lines in key",count)
         except:
             print ("Problem reading key")
             raise RuntimeError("Key parsing error")
 
-    def GetKey(self,sid,lastname,firstname):
+    # Read the binary answer key from exam-writer.py (see MakeBinaryKey
+    # in exam-writer.py for the format).  The matchers are built
+    # directly from the correct letter masks.
+    def ReadBinary(self,binaryFile):
+        try:
+            print(binaryFile)
+            with open(binaryFile,"rb") as f: data = f.read()
+            if data[:8] != b"EXAMKEY\x01": raise ValueError("Bad magic")
+            position = 8
+            def Read(code,count):
+                nonlocal position
+                values = array.array(code)
+                end = position + count*values.itemsize
+                values.frombytes(data[position:end])
+                if sys.byteorder == "big": values.byteswap()
+                position = end + (-end % 4)
+                return values
+            copies, width, count, size = Read("I",4)
+            offsets = Read("i",count+1)
+            strings = [data[position+offsets[i]:position+offsets[i+1]]
+                       .decode("utf-8") for i in range(count)]
+            position += size + (-size % 4)
+            fields = Read("i",4*copies)
+            questions = Read("i",copies*width)
+            correct = Read("I",copies*width)
+            exact = Read("B",copies*width)
+            for c in range(copies):
+                out = dict()
+                out["LASTNAME"] = strings[fields[4*c]]
+                out["FIRSTNAME"] = strings[fields[4*c+1]]
+                out["SID"] = strings[fields[4*c+2]]
+                out["Basename"] = strings[fields[4*c+3]]
+                matcher = list()
+                for i in range(c*width,(c+1)*width):
+                    if questions[i] < 0: break
+                    if exact[i]:
+                        answer = "".join(chr(ord("A")+b) for b in range(32)
+                                         if correct[i] & (1 << b))
+                        matcher.append((strings[questions[i]], True, answer))
+                    else:
+                        matcher.append((strings[questions[i]], False,
+                                        correct[i] << ord("A")))
+                out["Matcher"] = tuple(matcher)
+                print("KEYS ", out["LASTNAME"], out["FIRSTNAME"], out["SID"])
+                self.AddStudent(out)
+            print("lines in key",copies)
+        except:
+            print ("Problem reading binary key")
+            raise RuntimeError("Key parsing error")
+
+    # Add a "Choices" tuple to each key with the answer names (in
+    # letter order) for each question.  The `choices` come from
+    # ReadChoices, and are None when there aren't any answer choices.
+    def SetChoices(self,choices):
+        missing = 0
         for v in self.student:
-            if sid == v["SID"]:
-                return v
-        print("No matching key", sid)
-        return None
+            v["Choices"] = None
+            if choices is not None: v["Choices"] = choices.get(v["Basename"])
+            if v["Choices"] is None: missing = missing + 1
+        if choices is not None and missing > 0:
+            print("Keys without answer choices",missing)
+
+    def GetKey(self,sid,lastname,firstname):
+        v = self.FindStudent(sid,lastname,firstname)
+        if v is None: print("No matching key", sid)
+        return v
+
+# Read the answer choices from exam-writer.py.  This returns the
+# answer names for each question by the basename of the version (see
+# ExamKey.SetChoices).
+def ReadChoices(choicesFile):
+    try:
+        print(choicesFile)
+        choices = dict()
+        with io.open(choicesFile,"r",encoding="ascii",errors="ignore") as f:
+            for v in csv.DictReader(f):
+                choices[v["Basename"]] = tuple(
+                    tuple(names.split(','))
+                    for names in v["AnswerNames"].split(';'))
+    except:
+        print ("Problem reading choices")
+        raise RuntimeError("Choices parsing error")
+    return choices
 
 ###########################################################3
-# Read an response file from the opscan center and fill a dictionary
-# with "LASTNAME", "FIRSTNAME", "SID" (student identification number),
-# and a list with the provided answers for the student.  This may need
-# to be updated as the results format changes.  Check the file and
-# make the needed changes.
-#
-# NOTE: The scan file often includes header lines that need to be
-# skipped.  The best way is to use an editor by hand.
+# The layouts of the scan files from different scanners.  Each profile
+# lists the headers for the name and student ID columns (compared
+# without case, spaces or punctuation), and a regular expression for
+# the answer column headers that matches the question number.  Add a
+# profile here when a new scan format shows up.
+SCAN_PROFILES = [
+    {"Name": "opscan",
+     "LastName": ["LAST NAME"], "FirstName": ["FIRST NAME"],
+     "SID": ["STUDENT ID"], "Answers": r"(\d+)"},
+    {"Name": "scantron",
+     "LastName": ["LAST NAME", "LAST"], "FirstName": ["FIRST NAME", "FIRST"],
+     "SID": ["STUDENT ID", "ID", "SID", "STUDENT NUMBER"],
+     "Answers": r"(?:Q|ITEM|QUESTION) *(\d+)"},
+    {"Name": "zipgrade",
+     "LastName": ["LAST NAME"], "FirstName": ["FIRST NAME"],
+     "SID": ["EXTERNAL ID", "STUDENT ID", "ZIPGRADE ID"],
+     "Answers": r"STU(\d+)"},
+]
+
+# The number of characters read from the start of the scan file to find
+# the header, and the delimiters that are tried.
+SCAN_SAMPLE_SIZE = 65536
+SCAN_DELIMITERS = (",", "\t", ";")
+
+# Normalize a column header so the case, spaces and punctuation don't
+# matter.
+def HeaderName(name):
+    return "".join(c for c in str(name).upper() if c.isalnum())
+
+ScanLayout = collections.namedtuple("ScanLayout",
+                                    ["profile","delimiter","skip","lastname",
+                                     "firstname","sid","answers"])
+
+# Find the layout of a scan file from a sample of the start of the file.
+# Each delimiter is tried, and the first row that matches one of the
+# SCAN_PROFILES is the header (the rows before it are skipped).  This
+# returns a ScanLayout, or None if there isn't a header.
+def SniffScanLayout(sample):
+    # Only use complete lines (the sample can stop in the middle of one).
+    if "\n" in sample: sample = sample[:sample.rindex("\n")+1]
+    for delimiter in SCAN_DELIMITERS:
+        reader = csv.reader(io.StringIO(sample),delimiter=delimiter)
+        for skip, header in enumerate(reader):
+            layout = MatchScanProfile(header)
+            if layout is not None:
+                return layout._replace(delimiter=delimiter,skip=skip)
+    return None
+
+# Return the ScanLayout for a header row, or None if it doesn't match
+# one of the SCAN_PROFILES.
+def MatchScanProfile(header):
+    names = [HeaderName(name) for name in header]
+    for profile in SCAN_PROFILES:
+        columns = list()
+        for field in ("LastName", "FirstName", "SID"):
+            aliases = [HeaderName(name) for name in profile[field]]
+            found = [i for i, name in enumerate(names) if name in aliases]
+            if not found: break
+            columns.append(found[0])
+        if len(columns) < 3: continue
+        numbered = dict()
+        for i, name in enumerate(header):
+            match = re.fullmatch(profile["Answers"], name.strip().upper())
+            if match: numbered.setdefault(int(match.group(1)),i)
+        answers = list()
+        while len(answers)+1 in numbered:
+            answers.append(numbered[len(answers)+1])
+        if not answers: continue
+        return ScanLayout(profile["Name"], ",", 0,
+                          columns[0], columns[1], columns[2],
+                          tuple(answers))
+    return None
+
+# Read an response file from the scanner.  The file is read one row at
+# a time, and each student is returned as an AnswerScan tuple with the
+# last name, first name, student ID and the provided answers (in
+# question order, upper cased without spaces).  The layout of the file
+# is found from the start of the file (see SniffScanLayout), so any
+# lines before the header are skipped.
+AnswerScan = collections.namedtuple("AnswerScan",
+                                    ["lastname","firstname","sid","answers"])
+
 class ExamAnswers:
     def __init__(self):
-        self.student = list()
-    
+        self.count = 0
+
     def ReadFile(self,answerFile):
         try:
             print(answerFile)
             with io.open(answerFile,"r",encoding="ascii",errors="ignore") as f:
-                reader = csv.DictReader(f)
+                layout = SniffScanLayout(f.read(SCAN_SAMPLE_SIZE))
+                if layout is None:
+                    print("No scan header found in the first",
+                          SCAN_SAMPLE_SIZE, "characters")
+                    raise ValueError("Unknown scan format")
+                print("Scan format", layout.profile,
+                      "with", len(layout.answers), "questions",
+                      "after", layout.skip, "skipped lines")
+                f.seek(0)
+                reader = csv.reader(f,delimiter=layout.delimiter)
+                for row in range(layout.skip+1): next(reader)
+                last = layout.lastname
+                first = layout.firstname
+                sid = layout.sid
+                answers = layout.answers
                 for v in reader:
-                    out = dict()
-                    out["LASTNAME"] = v["LAST NAME"]
-                    out["FIRSTNAME"] = v["FIRST NAME"]
-                    out["SID"] = v["STUDENT ID"]
-                    out["Answers"] = list()
-                    try: 
-                        for i in range(1,1000):
-                            out["Answers"].append(v[str(i)].strip())
-                    except:
-                        pass
-                    self.student.append(out)
-                    
-                        
+                    if not v: continue
+                    self.count = self.count + 1
+                    yield AnswerScan(v[last], v[first], v[sid],
+                                     tuple(v[i].replace(" ","").upper()
+                                           for i in answers if i < len(v)))
         except:
             print ("Problem reading answers")
             raise RuntimeError("Answer parsing error")
 
-    def GetAnswers(self,sid,lastname,firstname):
-        for v in self.student:
-            if sid == v["SID"]:
-                return v
-        print("No matching answers", lastname, firstname, sid)
-        return None
-
-# Score the exam.  There are two cases.  If the key is upper case,
-# then the answer needs to exactly match the key ("ABC" must equal
-# "ABC").  If the key is lower case, then the answer must be inside
-# the key (B is inside "abc" so it's correct).
-def ScoreExam(key,answers,summary):
-    if answers is None: return 0
-    summary["TOTAL"] = summary["TOTAL"] + 1
-    score = 0
-    for zz in zip(key["Answers"],answers["Answers"],key["QuestionNames"]):
-        kind = "BOGO"
-        good = "wrong"
-        answer = zz[1].replace(" ","").upper()
-        key = zz[0].replace(" ","")
-        question = zz[2]
-        if key == key.lower():
+# Return a bit mask with a bit set for each character in the answer.
+@functools.lru_cache(maxsize=None)
+def LetterMask(answer):
+    mask = 0
+    for c in answer: mask |= 1 << ord(c)
+    return mask
+
+# Compile the answers in a key into a tuple with a matcher for each
+# question.  There are two cases.  If the key is upper case, then the
+# answer needs to exactly match the key ("ABC" must equal "ABC"), and
+# the matcher holds the key.  If the key is lower case, then the
+# answer must be inside the key (B is inside "abc" so it's correct),
+# and the matcher holds a mask of the letters in the key.  Each
+# matcher is (question, exact, correct).
+def CompileKey(answers,questions):
+    matcher = list()
+    for answer, question in zip(answers,questions):
+        answer = answer.replace(" ","")
+        if answer == answer.lower():
             # Implement "or" for lower case answers in the key
-            kind = "or"
-            for aa in answer:
-                if aa in key.upper():
-                    score = score + 1
-                    good = "correct"
-                    if not question in summary: summary[question] = 0
-                    summary[question] = summary[question] + 1
-                    break
+            matcher.append((question, False, LetterMask(answer.upper())))
         else:
             # Implement "and" for upper case answers in the key
-            kind = "and"
-            if key.upper() == answer:
-                good = "correct"
-                if not question in summary: summary[question] = 0
-                summary[question] = summary[question] + 1
-                score = score + 1
+            matcher.append((question, True, answer.upper()))
+    return tuple(matcher)
+
+# Return the answer names for the letters in an answer, using the
+# names for the question from the answer choices.  The names are
+# sorted (and repeats dropped) so the same choice is always reported
+# the same way, whatever order the letters came in for the version.
+@functools.lru_cache(maxsize=None)
+def AnswerChoice(answer,names):
+    choice = set()
+    for c in answer:
+        i = ord(c) - ord("A")
+        if 0 <= i < len(names): choice.add(names[i])
+        else: choice.add(c)
+    return "+".join(sorted(choice))
+
+# Score the exam using the compiled key (see CompileKey).  The answers
+# have already been upper cased with the spaces removed.  If `items`
+# is a list, then (question, good, answer) is added for each named
+# question (the key ends with an empty question).  If the key has the
+# answer choices, the answer is given by the answer names.
+def ScoreExam(key,answers,summary,items=None):
+    if answers is None: return 0
+    summary["TOTAL"] = summary["TOTAL"] + 1
+    score = 0
+    choices = key.get("Choices")
+    for i, ((question, exact, correct), answer) in enumerate(
+            zip(key["Matcher"], answers.answers)):
+        if exact: good = (answer == correct)
+        else: good = (LetterMask(answer) & correct) != 0
+        if good:
+            score = score + 1
+            summary[question] = summary.get(question,0) + 1
+        if items is not None and question:
+            if choices is not None and i < len(choices):
+                answer = AnswerChoice(answer,choices[i])
+            items.append((question, good, answer))
     return score
-    
+
+###########################################################3
+# Collect the scored questions for each student and calculate the item
+# analysis.  Each copy of the exam has a different question order, so
+# the questions are identified by the names from the key.  Since each
+# student may get a different set of questions, the statistics for a
+# question only use the students that had that question.
+#
+# - Difficulty: The fraction of the students with the correct answer.
+# - Discrimination: The difficulty for the top 27% of the students
+#       (by score) minus the difficulty for the bottom 27%.
+# - PointBiserial: The correlation between getting the question right
+#       and the score.
+# - Responses: The number of times each answer was given (by answer
+#       name if the answer choices are available).
+# - KR20: The Kuder-Richardson reliability of the exam.  The variance
+#       of each question is weighted by the fraction of the students
+#       that had the question.
+class ItemAnalysis:
+    def __init__(self):
+        self.students = list()
+
+    def AddStudent(self,score,items):
+        self.students.append((score,tuple(items)))
+
+    # Return a dictionary with the statistics for the exam, and for
+    # each question (in "Questions").
+    def Analyze(self):
+        count = len(self.students)
+        exam = {"Students": count, "Mean": None, "Variance": None,
+                "KR20": None, "Questions": dict()}
+        if count < 1: return exam
+        scores = [score for score, items in self.students]
+        mean = sum(scores)/count
+        variance = sum((x-mean)**2 for x in scores)/count
+        exam["Mean"] = mean
+        exam["Variance"] = variance
+
+        # The students in the top and bottom groups.
+        group = max(1,int(round(0.27*count)))
+        order = sorted(range(count), key=lambda i: scores[i])
+        lower = set(order[:group])
+        upper = set(order[-group:])
+
+        stats = dict()
+        for i, (score, items) in enumerate(self.students):
+            for question, good, answer in items:
+                q = stats.get(question)
+                if q is None:
+                    q = stats[question] = {"n": 0, "correct": 0,
+                                           "sum": 0.0, "sum2": 0.0,
+                                           "sumCorrect": 0.0,
+                                           "upper": [0,0], "lower": [0,0],
+                                           "responses": dict()}
+                q["n"] += 1
+                q["sum"] += score
+                q["sum2"] += score*score
+                q["responses"][answer] = q["responses"].get(answer,0) + 1
+                if good:
+                    q["correct"] += 1
+                    q["sumCorrect"] += score
+                if i in upper:
+                    q["upper"][0] += 1
+                    q["upper"][1] += good
+                if i in lower:
+                    q["lower"][0] += 1
+                    q["lower"][1] += good
+
+        weighted = 0.0
+        items = 0.0
+        for question in sorted(stats):
+            q = stats[question]
+            n = q["n"]
+            p = q["correct"]/n
+            discrimination = None
+            if q["upper"][0] > 0 and q["lower"][0] > 0:
+                discrimination = (q["upper"][1]/q["upper"][0]
+                                  - q["lower"][1]/q["lower"][0])
+            biserial = None
+            qMean = q["sum"]/n
+            qDeviation = math.sqrt(max(q["sum2"]/n - qMean*qMean,0.0))
+            if 0 < q["correct"] < n and qDeviation > 0:
+                right = q["sumCorrect"]/q["correct"]
+                wrong = (q["sum"] - q["sumCorrect"])/(n - q["correct"])
+                biserial = (right - wrong)/qDeviation*math.sqrt(p*(1.0-p))
+            exam["Questions"][question] = {
+                "Students": n,
+                "Correct": q["correct"],
+                "Difficulty": p,
+                "Discrimination": discrimination,
+                "PointBiserial": biserial,
+                "Responses": dict(sorted(q["responses"].items()))}
+            weighted += n/count*p*(1.0-p)
+            items += n/count
+        if items > 1 and variance > 0:
+            exam["KR20"] = items/(items-1)*(1.0 - weighted/variance)
+        return exam
+
+    # Write the item analysis as JSON (if the file name ends with
+    # ".json"), or as CSV with a row for each question and a final
+    # "TOTAL" row for the exam.
+    def WriteFile(self,reportFile):
+        exam = self.Analyze()
+        print("Write item analysis to", reportFile)
+        with open(reportFile,"w") as f:
+            if reportFile.lower().endswith(".json"):
+                json.dump(exam,f,indent=2)
+                return
+            def Format(value):
+                if value is None: return ""
+                if type(value) is float: return "%.4f" % value
+                return str(value)
+            fields = ["Question", "Students", "Correct", "Difficulty",
+                      "Discrimination", "PointBiserial", "Responses",
+                      "Mean", "Variance", "KR20"]
+            output = csv.writer(f)
+            output.writerow(fields)
+            for question, q in exam["Questions"].items():
+                responses = ";".join(str(k) + "=" + str(v)
+                                     for k, v in q["Responses"].items())
+                output.writerow([question] +
+                                [Format(q[k]) for k in fields[1:6]] +
+                                [responses, "", "", ""])
+            output.writerow(["TOTAL", Format(exam["Students"]),
+                             "", "", "", "", "",
+                             Format(exam["Mean"]),
+                             Format(exam["Variance"]),
+                             Format(exam["KR20"])])
+
+###########################################################3
+# Reconcile the scans that didn't match the roster with the roster
+# students that didn't have a scan (usually a mis-bubbled student ID).
+# The scans are indexed by SID in a BK-tree (so the nearby SIDs are
+# found without comparing every scan), and by the normalized last and
+# first names.  A scan is a possible match for a student if both names
+# match, or if the SID is within RECONCILE_DISTANCE edits and one of
+# the names match (or the SID is within one edit).
+RECONCILE_DISTANCE = 2
+
+# The number of single character edits to change one string into
+# another (the Levenshtein distance).
+def EditDistance(a,b):
+    previous = list(range(len(b)+1))
+    for i, ca in enumerate(a):
+        current = [i+1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j+1]+1, current[j]+1,
+                               previous[j]+(ca != cb)))
+        previous = current
+    return previous[-1]
+
+# A BK-tree of strings using the EditDistance.  Each node is a list of
+# the word, the items for the word, and the children by distance.
+class BKTree:
+    def __init__(self):
+        self.root = None
+
+    def Add(self,word,item):
+        if self.root is None:
+            self.root = [word, [item], dict()]
+            return
+        node = self.root
+        while True:
+            distance = EditDistance(word,node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [word, [item], dict()]
+                return
+            node = node[2][distance]
+
+    # Return a list of (distance, item) for the items with a word
+    # within `limit` edits of `word`.
+    def Find(self,word,limit):
+        found = list()
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = EditDistance(word,node[0])
+            if distance <= limit:
+                found += [(distance, item) for item in node[1]]
+            for d in range(distance-limit, distance+limit+1):
+                if d in node[2]: nodes.append(node[2][d])
+        return found
+
+# Find the matches between the roster `students` and the unmatched
+# `scans`.  The proposed matches are printed, and this returns a
+# dictionary of the scan for each matched student (by id).  A student
+# with more than one equally good match isn't matched.
+def ReconcileScans(students,scans):
+    if not students or not scans: return dict()
+    tree = BKTree()
+    byName = dict()
+    for scan in scans:
+        tree.Add(scan.sid.strip(),scan)
+        last, first = NormalizeName(scan.lastname,scan.firstname)
+        if last: byName.setdefault(("LAST",last),list()).append(scan)
+        if first: byName.setdefault(("FIRST",first),list()).append(scan)
+    proposals = list()
+    for student in students:
+        sid = student["SID"].strip()
+        last, first = NormalizeName(student["LASTNAME"],student["FIRSTNAME"])
+        candidates = dict()
+        for distance, scan in tree.Find(sid,RECONCILE_DISTANCE):
+            candidates[id(scan)] = (scan, distance)
+        for scan in (byName.get(("LAST",last),[])
+                     + byName.get(("FIRST",first),[])):
+            if id(scan) in candidates: continue
+            candidates[id(scan)] = (scan, EditDistance(sid,scan.sid.strip()))
+        ranked = list()
+        for scan, distance in candidates.values():
+            scanLast, scanFirst = NormalizeName(scan.lastname,scan.firstname)
+            names = ((last != "" and scanLast == last)
+                     + (first != "" and scanFirst == first))
+            if names < 2 and distance > RECONCILE_DISTANCE: continue
+            if names < 1 and distance > 1: continue
+            ranked.append((distance + 2 - names, scan, distance))
+        if not ranked: continue
+        ranked.sort(key=lambda x: x[0])
+        if len(ranked) > 1 and ranked[1][0] == ranked[0][0]:
+            print("Ambiguous match for", student["SID"],
+                  student["LASTNAME"], student["FIRSTNAME"])
+            continue
+        proposals.append((ranked[0][0], student, ranked[0][1], ranked[0][2]))
+    matches = dict()
+    used = set()
+    for cost, student, scan, distance in sorted(proposals,
+                                                key=lambda x: x[0]):
+        if id(scan) in used: continue
+        used.add(id(scan))
+        matches[id(student)] = scan
+        print("Proposed match", student["SID"], student["LASTNAME"],
+              student["FIRSTNAME"], "<- scan", scan.sid, scan.lastname,
+              scan.firstname, "(SID distance", str(distance) + ")")
+    print("Proposed matches",len(matches),"for",len(students),
+          "students and",len(scans),"unmatched scans")
+    return matches
+
+###########################################################3
+# The rosters and keys that have been read.  These are reused when
+# several exams are graded with the same roster or key.  The files are
+# identified by the name and the modification time.
+cache = dict()
+
+def CacheName(kind,*files):
+    name = [kind]
+    for filename in files:
+        if filename is None:
+            name.append(None)
+            continue
+        name += [os.path.abspath(filename), os.path.getmtime(filename)]
+    return tuple(name)
+
+# Read a roster (or reuse the one that was already read).
+def LoadRoster(rosterFile):
+    name = CacheName("roster",rosterFile)
+    roster = cache.get(name)
+    if roster is None:
+        roster = ExamRoster()
+        roster.ReadFile(rosterFile)
+        cache[name] = roster
+    roster.Reset()
+    return roster
+
+# Read a key (or reuse the one that was already read).  The binary key
+# is used if it is next to the CSV key, and isn't older.  If the
+# `choicesFile` is provided, the answer choices are added to the key.
+# The choices are cached separately, so a key is only read once no
+# matter which choices go with it.
+def LoadKey(keyFile,choicesFile=None):
+    binaryKey = keyFile + ".bin"
+    if (not os.path.isfile(binaryKey)
+        or os.path.getmtime(binaryKey) < os.path.getmtime(keyFile)):
+        binaryKey = None
+    name = CacheName("key",keyFile,binaryKey)
+    keys = cache.get(name)
+    if keys is None:
+        keys = ExamKey()
+        if binaryKey is not None: keys.ReadBinary(binaryKey)
+        else: keys.ReadFile(keyFile)
+        cache[name] = keys
+    choices = None
+    if choicesFile is not None:
+        name = CacheName("choices",choicesFile)
+        choices = cache.get(name)
+        if choices is None:
+            choices = ReadChoices(choicesFile)
+            cache[name] = choices
+    keys.SetChoices(choices)
+    keys.Reset()
+    return keys
+
+###########################################################3
+# The grading state is saved next to the results (with a ".digest"
+# suffix).  It holds a digest of the answers and key for each student
+# (by SID), with the score and the correctly answered questions, so
+# that a regrade only needs to rescore the students that changed.
+def ReadGradeState(stateFile):
+    if not os.path.isfile(stateFile): return dict()
+    try:
+        with open(stateFile,"r") as f: return json.load(f)
+    except:
+        print("Ignoring bad grading state", stateFile)
+        return dict()
+
+def WriteGradeState(stateFile,state):
+    handle, temporary = tempfile.mkstemp(prefix=".",
+                                         dir=os.path.dirname(stateFile) or ".")
+    with os.fdopen(handle,"w") as f: json.dump(state,f)
+    os.replace(temporary,stateFile)
+
+# Grade one student (the `answer` is None if the student has no scan).
+# If the digest of the answers and key matches the `previous` state,
+# the old score is reused (unless there is an item analysis).  The new
+# state is saved in `state`.  This returns the score and true if the
+# student was rescored.
+def GradeStudent(student,answer,summary,analysis,previous,state):
+    answers = None
+    if answer is not None: answers = answer.answers
+    digest = hashlib.sha1(repr((student["Key"]["Matcher"],answers))
+                          .encode("utf-8")).hexdigest()
+    old = previous.get(student["SID"])
+    rescored = True
+    if old is not None and old["Digest"] == digest and analysis is None:
+        score = old["Score"]
+        correct = old["Correct"]
+        if answer is not None:
+            summary["TOTAL"] = summary["TOTAL"] + 1
+            for question in correct:
+                summary[question] = summary.get(question,0) + 1
+        rescored = False
+    else:
+        items = list()
+        score = ScoreExam(student["Key"],answer,summary,items)
+        correct = [question for question, good, a in items if good]
+        if analysis is not None and answer is not None:
+            analysis.AddStudent(score,items)
+    state[student["SID"]] = {"Digest": digest, "Score": score,
+                             "Correct": correct}
+    if old is not None and old["Score"] != score:
+        print("Score changed", student["SID"], student["LASTNAME"],
+              student["FIRSTNAME"], old["Score"], "->", score,
+              "(%+d)" % (score - old["Score"]))
+    return score, rescored
+
+###########################################################3
+# Grade one exam.  The results are written to `resultsFile` (which
+# must not exist unless `regrade` is true).  When regrading, only the
+# students whose answers or key changed since the last grading are
+# rescored, and the results are replaced atomically.  The unmatched
+# scans are reconciled with the students without a scan, and the
+# proposed matches are graded if `reconcile` is true.  If `reportFile`
+# is provided, the item analysis is written to it.  This returns the
+# summary of the correct responses.
+def GradeExam(rosterFile,keyFile,answersFile,resultsFile,
+              reportFile=None,choicesFile=None,regrade=False,
+              reconcile=False):
+    # Read the roster to grade.
+    roster = LoadRoster(rosterFile)
+
+    # Read the key for the exam, and the answer choices so the item
+    # analysis can use the answer names.
+    if reportFile and choicesFile is None:
+        choicesFile = os.path.splitext(keyFile)[0] + ".choices"
+        if not os.path.isfile(choicesFile): choicesFile = None
+    if not reportFile: choicesFile = None
+    keys = LoadKey(keyFile,choicesFile)
+
+    # Find the key for every student before any results are written.
+    for student in roster.student:
+        student["Key"] = keys.GetKey(student["SID"],
+                                     student["LASTNAME"],
+                                     student["FIRSTNAME"])
+        if student["Key"] is None:
+            print (student["SID"],student["LASTNAME"],student["FIRSTNAME"])
+            raise RuntimeError("Missing key")
+
+    # Grade the answers for each student as they are read, and write
+    # the result right away.  The answers that only match a student by
+    # name are held until all of the answers are read, so an answer
+    # with the right SID is always used first.  The students without
+    # answers get a zero.
+    summary = dict()
+    summary['TOTAL'] = 0
+    analysis = None
+    if reportFile: analysis = ItemAnalysis()
+    stateFile = resultsFile + ".digest"
+    previous = dict()
+    if regrade: previous = ReadGradeState(stateFile)
+    state = dict()
+    rescored = 0
+    lastKey = roster.fields[-1]
+    graded = set()
+    unmatched = list()
+    temporary = None
+    # The results are written to a temporary file that replaces the
+    # results file when everything is graded, so a failure doesn't
+    # leave a partial results file.  Without --regrade, an existing
+    # results file isn't replaced.
+    if not regrade and os.path.exists(resultsFile):
+        print("Results file already exists", resultsFile)
+        raise RuntimeError("Bad result write")
+    try:
+        handle, temporary = tempfile.mkstemp(
+            prefix=".", dir=os.path.dirname(resultsFile) or ".")
+        with os.fdopen(handle,"w") as f:
+            output = csv.DictWriter(f,roster.fields)
+            output.writeheader()
+            byName = list()
+            for answer in ExamAnswers().ReadFile(answersFile):
+                student = roster.FindBySID(answer.sid)
+                if student is None:
+                    byName.append(answer)
+                    continue
+                if id(student) in graded:
+                    print("Duplicate answers", answer.lastname,
+                          answer.firstname, answer.sid)
+                    continue
+                graded.add(id(student))
+                score, changed = GradeStudent(student,answer,summary,
+                                              analysis,previous,state)
+                rescored = rescored + changed
+                student["Row"][lastKey] = str(score)
+                output.writerow(student["Row"])
+            # Match the remaining answers by name to the students that
+            # don't have answers yet.  The rest are left to reconcile.
+            for answer in byName:
+                student = None
+                names = roster.byName.get(NormalizeName(answer.lastname,
+                                                        answer.firstname),[])
+                if len(names) == 1 and id(names[0]) not in graded:
+                    student = roster.FindByName(answer.sid,
+                                                answer.lastname,
+                                                answer.firstname)
+                if student is None:
+                    print("No matching student",
+                          answer.lastname, answer.firstname, answer.sid)
+                    unmatched.append(answer)
+                    continue
+                graded.add(id(student))
+                score, changed = GradeStudent(student,answer,summary,
+                                              analysis,previous,state)
+                rescored = rescored + changed
+                student["Row"][lastKey] = str(score)
+                output.writerow(student["Row"])
+            missing = roster.ReportUnmatched()
+            matches = ReconcileScans(missing,unmatched)
+            for student in missing:
+                answer = None
+                if reconcile and id(student) in matches:
+                    answer = matches[id(student)]
+                    print("Grading", student["SID"], "with scan", answer.sid)
+                score, changed = GradeStudent(student,answer,summary,
+                                              analysis,previous,state)
+                rescored = rescored + changed
+                student["Row"][lastKey] = str(score)
+                output.writerow(student["Row"])
+        # Give the results the usual permissions (not just the owner).
+        mask = os.umask(0)
+        os.umask(mask)
+        os.chmod(temporary, 0o666 & ~mask)
+        os.replace(temporary,resultsFile)
+        WriteGradeState(stateFile,state)
+    except RuntimeError:
+        raise
+    except:
+        raise RuntimeError("Bad result write")
+    finally:
+        if temporary is not None and os.path.isfile(temporary):
+            os.remove(temporary)
+    print("Rescored",rescored,"of",len(state),"students")
+
+    # Report the keys that didn't match a student on the roster.
+    keys.ReportUnmatched()
+
+    res = {key: val
+           for key, val in sorted(summary.items(), key = lambda ele: ele[0])}
+
+    print("SUMMARY OF EXAM RESPONSES", resultsFile)
+    for q in res:
+        if q == "TOTAL": continue
+        print("      Correct responses to ", q,summary[q])
+    print("   Total students taking exam",summary["TOTAL"])
+
+    # Write the item analysis for the questions.
+    if analysis is not None: analysis.WriteFile(reportFile)
+    return summary
+
+###########################################################3
+# Read a manifest of exams to grade.  This is a CSV file with "Roster",
+# "Key", "Answers" and "Results" columns, and optional "Report" and
+# "Choices" columns.  The file names are relative to the manifest.
+def ReadManifest(manifestFile):
+    directory = os.path.dirname(manifestFile)
+    fields = ("Roster", "Key", "Answers", "Results", "Report", "Choices")
+    jobs = list()
+    try:
+        with io.open(manifestFile,"r",encoding="ascii",errors="ignore") as f:
+            for v in csv.DictReader(f):
+                v = {k.strip().lower(): v[k] for k in v if k}
+                job = list()
+                for k in fields:
+                    value = (v.get(k.lower()) or "").strip()
+                    if value: value = os.path.join(directory,value)
+                    else: value = None
+                    job.append(value)
+                if None in job[:4]: raise ValueError("Missing file name")
+                jobs.append(tuple(job))
+    except:
+        print ("Problem reading manifest")
+        raise RuntimeError("Manifest parsing error")
+    return jobs
+
+# Grade a group of exams that share a key.  This returns a list of
+# (results, error) with the error message for exams that failed.
+def GradeGroup(jobs):
+    status = list()
+    for job in jobs:
+        try:
+            GradeExam(*job,regrade=options.regrade,
+                      reconcile=options.reconcile)
+            status.append((job[3], None))
+        except Exception as error:
+            status.append((job[3], str(error)))
+    return status
+
+# Grade all of the exams in a manifest using `jobs` processes.  The
+# exams that share a key are graded in the same process so the roster
+# and key are only read once.  This returns the number of failures.
+def GradeManifest(manifestFile,jobs):
+    groups = dict()
+    for job in ReadManifest(manifestFile):
+        groups.setdefault(os.path.abspath(job[1]),list()).append(job)
+    groups = list(groups.values())
+    if jobs > 1 and len(groups) > 1:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(jobs,len(groups))) as pool:
+            results = pool.map(GradeGroup, groups)
+    else:
+        results = [GradeGroup(group) for group in groups]
+    failed = 0
+    for results, error in [x for group in results for x in group]:
+        if error is None:
+            print("Graded", results)
+            continue
+        print("Failed to grade", results, error)
+        failed = failed + 1
+    return failed
+
 ####################################################################
 # The main code begins here.
 
 print("Hello world from exam-grader")
 
-# Read the roster to grade.
-roster = ExamRoster()
-roster.ReadFile(options.roster[0])
-
-# Read the key for the exam
-keys = ExamKey()
-keys.ReadFile(options.key[0])
-
-# Read the answers for each student to the exam
-answers = ExamAnswers()
-answers.ReadFile(options.answers[0])
-
-summary = dict()
-summary['TOTAL'] = 0
-for student, entry in zip(roster.student,roster.roster):
-    key = keys.GetKey(student["SID"],student["LASTNAME"],student["FIRSTNAME"])
-    if key is None:
-        print (student["SID"],student["LASTNAME"],student["FIRSTNAME"])
-        raise RuntimeError("Missing key")
-    answer = answers.GetAnswers(student["SID"],
-                                student["LASTNAME"],
-                                student["FIRSTNAME"])
-    lastKey = list(entry.keys())[-1]
-    score = ScoreExam(key,answer,summary)
-    entry[lastKey] = str(score)
-
-res = {key: val
-       for key, val in sorted(summary.items(), key = lambda ele: ele[0])}
-
-print("SUMMARY OF EXAM RESPONSES")
-for q in res:
-    if q == "TOTAL": pass
-    print("      Correct responses to ", q,summary[q])
-print("   Total students taking exam",summary["TOTAL"])
-
-fields = list(roster.roster[0].keys())
-
-try:
-    with open(options.results[0],"x") as f:
-        output = csv.DictWriter(f,fields)
-        output.writeheader()
-        for row in roster.roster:
-            output.writerow(row)
-except:
-    raise RuntimeError("Bad result write")
+if options.manifest is not None:
+    if GradeManifest(options.manifest,options.jobs) > 0: sys.exit(1)
+else:
+    GradeExam(options.roster,options.key,options.answers,options.results,
+              options.report,options.choices,options.regrade,
+              options.reconcile)
@@ -0,0 +1,2980 @@
+#!/usr/bin/env python3
+
+import yaml
+import csv
+import string
+import textwrap
+from graphlib import TopologicalSorter, CycleError
+import argparse
+import random
+import os.path
+import re
+import sys
+import json
+import pickle
+import math
+import io
+import functools
+import ast
+import multiprocessing
+import heapq
+import hashlib
+import array
+import subprocess
+import tempfile
+import shutil
+import filecmp
+import concurrent.futures
+import time
+
+parser = argparse.ArgumentParser(
+    description="Write an exam based on YAML input files")
+parser.add_argument("file",nargs=1,
+                    help="An input file describing the exam")
+parser.add_argument('-a','--all', dest='allQuestions', default=False,
+                    action='store_true',
+                    help="Include all questions and do not reorder")
+parser.add_argument('-d','--dry-run', dest='dryRun', default=False,
+                    action='store_true',
+                    help="Don't generate output files")
+parser.add_argument('-D','--dump', dest='dumpInput', default=False,
+                    action='store_true',
+                    help="Dump the input file to the output")
+parser.add_argument('-O','--one-version', dest='oneVersion', default=False,
+                    action='store_true',
+                    help="Build a single version (for debugging exam)")
+parser.add_argument('-C','--only-copy', dest='onlyCopy', default=None,
+                    type=int,
+                    help="Rebuild one copy (the seed is read from the key)")
+parser.add_argument('-P','--pickle', dest='pickle', default=False,
+                    action='store_true',
+                    help="Load existing exam version from a pickle file")
+parser.add_argument('-F','--force', dest='force', default=False,
+                    action='store_true',
+                    help="Rebuild every version (ignore the build cache)")
+parser.add_argument('-j','--jobs', dest='jobs', default=1, type=int,
+                    help="Build the versions using JOBS processes")
+parser.add_argument('--pdf', dest='pdf', default=False,
+                    action='store_true',
+                    help="Build the exam and solution PDF files")
+parser.add_argument('-S','--seed', dest='seed', default=None, type=int,
+                    help="The random seed (recorded in the key)")
+parser.add_argument('-Y','--yaml', dest='dumpYAML', default=False,
+                    action='store_true',
+                    help="Dump a YAML representation of the parsed input")
+parser.add_argument('-W','--watch', dest='watch', default=False,
+                    action='store_true',
+                    help="Rebuild the versions when the input files change")
+
+## Return the options for the library functions.
+#
+# These are the defaults of the command line options, changed by the
+# keyword arguments (e.g. `ExamOptions(seed=10, jobs=4)`).
+def ExamOptions(**kwargs) -> argparse.Namespace:
+    options = parser.parse_args([""])
+    options.file = []
+    for k in kwargs:
+        if not hasattr(options, k): raise ValueError("Unknown option " + k)
+        setattr(options, k, kwargs[k])
+    return options
+
+###################################################################
+# The Value class hierarchy: These are for holding values that will be
+# used in the exam.  They are used to implement constants, global
+# variables, random variables (both for a list of values and a value
+# in a range.
+###################################################################
+
+## An object containing one particular instance of a value.
+#
+# An instance of an object will have one possible value of the object
+# and will not change.  This is what will eventually be substituted
+# into the exam.  The ValueInstance objects are returned by the
+# `Value.get()` method.  The value of the instance is generated when
+# it is constructed and not changed.  The random number generator,
+# `rng`, can be the `random` module, or a `random.Random` object.
+class ValueInstance(object):
+    def __init__(self,value,instance=None,rng=random):
+        self.value = value
+        if instance is None: instance = value.update(rng)
+        self.instance = instance
+
+    def __str__(self): return self.get()
+
+    def name(self) -> str: return self.value.name()
+
+    def get(self) -> str : return self.instance
+
+## An object containing a named value.
+#
+# This provides the base class for several other value related classes
+# and implements the external interface.
+class Value(object):
+    """An object containing a named string value."""
+
+    ## Construct a Value object `Value('name')`
+    #
+    # A Value object with `name` is constructed with an intial
+    # value of 'not-set'.
+    def __init__(self, name: str):
+        self.type = "str"
+        self.valueName = name
+
+    ## Return the name of the object.
+    def name(self) -> str:
+        return self.valueName
+
+    ## Get an instance of the object.
+    #
+    # If `instance` is provided, it is used as the value (usually it
+    # comes from `sample()`), otherwise a new value is generated using
+    # the random number generator `rng`.
+    def get(self, instance=None, rng=random):
+        return ValueInstance(self, instance, rng)
+
+    ## Set the name of the object.
+    #
+    # Be careful using this since the object is often in a dictionary
+    # where it is assumed that the object name will match the key
+    # name.
+    def setName(self, name: str) -> None:
+        self.valueName = name
+
+    ## Update the value of the object
+    #
+    # This is a "no-op" for the base class.  For derived classes this
+    # may update the value.  Example: RandomRangeValue.
+    def update(self, rng=random) -> str:
+        return "not-set"
+
+    ## Generate `count` new values of the object.
+    #
+    # This is the same as calling `update()` `count` times, but the
+    # derived classes can draw all of the values at once.
+    def sample(self, count: int, rng=random) -> list:
+        return [self.update(rng) for i in range(count)]
+
+## An object containing a constant string value.
+#
+class ConstantValue(Value):
+
+    ## Construct the object.
+    #
+    # This requires the `name` of the object and a string value
+    # `v`.  The value cannot be changed after it is constructed.
+    def __init__(self, name: str, v: str):
+        super().__init__(name)
+        self.value = v
+
+    def update(self, rng=random) -> str: return self.value
+
+    def sample(self, count: int, rng=random) -> list: return [self.value]*count
+
+## An object that chooses a random element of a list and returns as a string
+#
+# When update is called, this will choose a new element of the value list.
+class RandomListValue(Value):
+    ## Construct a RandomListValue object
+    #
+    # This constructs a RandomeListValue object with `name`, and a
+    # dictionary `inputs`.  The dictionary must contain the keys
+    #
+    # - Significant: [int, optional] The number of significant figures
+    #
+    # - Values: [list, required] A list of values that will be chosen
+    #   by update. For example, inputs can have a value of `{"Values":
+    #   ["one", "two", "three"]}`
+    #
+    # - Type: [str|float, optional] If the value is a number, how
+    #   should it be converted into a string. [x
+    def __init__(self, name: str, inputs: dict):
+        super().__init__(name)
+        if "Values" not in inputs: raise ValueError("Must include Values")
+        v = inputs["Values"]
+        if not type(v) is list: raise ValueError("Must be a list")
+        self.values = v
+        if "Type" in inputs: self.type = inputs["Type"]
+        self.significant = None
+        if "Significant" in inputs: self.significant=str(inputs["Significant"])
+
+
+    ## Not a valid operation on this class
+    def set(self, v : str) -> None:
+        raise RuntimeError("Cannot set a RandomListValue")
+
+    ## Update the value with a new choice from the list of values.
+    #
+    # The value in the list will be converted to a string using `str()`.
+    def update(self, rng=random) -> str:
+        # Generate a new value.
+        return self.format(rng.choice(self.values))
+
+    ## Choose `count` values from the list at once.
+    #
+    # Each distinct value is only converted to a string once.
+    def sample(self, count: int, rng=random) -> list:
+        chosen = rng.choices(range(len(self.values)), k=count)
+        strings = dict()
+        for i in set(chosen): strings[i] = self.format(self.values[i])
+        return [strings[i] for i in chosen]
+
+    ## Convert one of the values into a string.
+    def format(self, v) -> str:
+        if self.type == "int": v = int(v)
+        if self.type == "float": v = float(v)
+        if self.significant is not None:
+            v = SignificantFigures(v,str(self.significant)+"g")
+        return str(v);
+
+## An object that chooses a value inside a range.
+#
+# When `update()` is called, this will generate a new value inside the
+# range.
+class RandomRangeValue(Value):
+
+    ## Construct a RandomRangeValue object
+    #
+    # This constructs a `RandomRangeValue` object with `name`, and a
+    # dictionary `inputs`.  The dictionary must contain the keys
+    #
+    # - Significant: [int, optional] The number of significant figures
+    #
+    # - Minimum : [float, required] The minimum value of the range
+    #
+    # - Maximum : [float, required] The maximum value of the range
+    #
+    # - Step : [float, required] The step between choses values in the
+    #   range
+    #
+    # - Type : [int|float] How to translate the numeric value into a
+    #   string
+    #
+    def __init__(self, name: str, inputs: dict):
+        super().__init__(name)
+        if "Minimum" not in inputs: raise ValueError("Must include Minimum")
+        self.minimum = float(inputs["Minimum"])
+        if "Maximum" not in inputs: raise ValueError("Must include Maximum")
+        self.maximum = float(inputs["Maximum"])
+        if "Step" not in inputs: raise ValueError("Must include Step")
+        self.step = float(inputs["Step"])
+        if "Type" in inputs: self.type = inputs["Type"]
+        self.significant = None
+        if "Significant" in inputs: self.significant=str(inputs["Significant"])
+
+    ## Not a valid operation for this class
+    def set(self, v : str) -> None:
+        raise RuntimeError("Cannot set a RandomRangeValue")
+
+    ## Choose a new value from the range.
+    def update(self, rng=random) -> str:
+        return self.format(rng.randint(0,self.steps()))
+
+    ## Choose `count` values from the range at once.
+    #
+    # Each distinct value is only converted to a string once.
+    def sample(self, count: int, rng=random) -> list:
+        chosen = rng.choices(range(self.steps()+1), k=count)
+        strings = dict()
+        for i in set(chosen): strings[i] = self.format(i)
+        return [strings[i] for i in chosen]
+
+    ## The number of steps in the range.
+    def steps(self) -> int:
+        i = int((self.maximum-self.minimum)/self.step+1E-6)
+        if i<0: i = 0
+        return i
+
+    ## Convert the value for step `i` into a string.
+    def format(self, i: int) -> str:
+        v = self.minimum + self.step*i
+        if self.type == "int": v = int(v)
+        if self.type == "float": v = float(v)
+        if self.significant is not None:
+            v = SignificantFigures(v,str(self.significant)+"g")
+        return str(v);
+
+## Build a dictionary of ConstantValue objects
+#
+# Take an input dictionary of constant names and values and return a
+# dictionary that can be used to update a dictionary of constant
+# definitions.  The dictionary should have entries with the key being
+# the constant name and the value being a string associated with the
+# name.
+def MakeConsts(d : dict) -> dict:
+    out = dict()
+    for key in d:
+        val = d[key]
+        if not type(val) is str:
+            print("The value for",key,"must be a string:", val)
+            raise ValueError("Constants must be strings")
+        out[key] = ConstantValue(key,val)
+    return out
+
+## Build a dictionary of RandomRangeValue and RandomListValue objects
+#
+# Take an input dictionary of names and values and return a dictionary
+# that can be used to update a dictionary of variable definitions.
+# The dictionary should have entries with the key being the name and
+# the a dictionary to build either a RandomRangeValue or a
+# RandomListValue object.
+def MakeValues(d : dict) -> dict:
+    out = dict()
+    for key in d:
+        val = d[key]
+        if type(val) is str: out[key] = Value(key,val)
+        elif "Values" in val: out[key] = RandomListValue(key,val)
+        else: out[key] = RandomRangeValue(key,val)
+    return out
+
+## A class to hold an Answer.
+#
+# This is one multiple choice answer that will be added to a question.
+# The answer is described by a `name` and a dictionary.  The `name` is
+# arbitrary, but should be unique within a question, and is used to
+# reference the answer inside of the question description.  The order
+# of answers may be randomized for the exam.  The input dictionary
+# describes the answer and has the following keys.
+#
+# - Correct : [yes|no, required] Is this a correct answer to the
+#   question.
+#
+# - Text : [str, required] A template for the LaTeX that will be used
+#   to build the answer.  Strings with the format &{name} will be
+#   substituted with the answer is build.  In addition to Value
+#   objects defined for the question and exam, the names are available
+#
+# - Before : ["all"|name|regex|list, optional] A selection of answer
+#   names that this answer must be before ("all" means this is the
+#   first answer).
+#
+# - After : ["all"|name|regex|list, optional] a selection of answer
+#   names that htis answer must be after ("all" means that this is the
+#   last answer).
+#
+# - Follows: [name, optional] A name of a answer that this must
+#   follow.  This answer will come immediately after the named answer.
+#
+class Answer(object):
+    def __init__(self, name: str, d: dict):
+        self.configuration = d
+        self.name = name
+        self.before = None
+        self.after = None
+        self.follows = None
+
+        # Check for required keys
+        if "Correct" not in d: raise ValueError("Must be have Correct field")
+        if "Text" not in d: raise ValueError("Answer must have text")
+        for k in d:
+            if "Text" == k:  self.text = d[k]
+            elif "Correct" == k: self.correct = d[k]
+            elif "Before" == k: self.before = d[k]
+            elif "After" == k: self.after = d[k]
+            elif "Follows" == k: self.follows = d[k]
+            else:
+                print("Bad key",k,"in",d)
+                raise ValueError("Unknown key in question")
+
+## Build a dictionary of Answer objects.
+#
+# This produces a dictionary with a key being the answer name, and the
+# value is the associated Answer object.  The input dictionary should
+# have keys that are the answer names, and a dictionary as described
+# for the Answer object.
+def MakeAnswers(d : dict) -> dict:
+    out = dict()
+    for key in d:
+        val = d[key]
+        if not type(val) is dict:
+            print("The value for",key,"must be a dictionary")
+            raise ValueError("Answers must be dictionaries")
+        out[key] = Answer(key,val)
+    return out
+
+## An object describing one question.
+#
+# This is one multiple choice question that will be added to the exam.
+# The question is constructed using a dictionary.  The
+# order of the questions may be randomized for the exam.  The input
+# dictionary describes the question and has the following keys:
+#
+# - Name : [str, required] The `name` is arbitrary, but should be
+#   unique within the exam.  It is used to reference the question
+#   inside the exam description.
+#
+# - Points : [int, optional] The number of points for this question.
+#   The value can be referenced inside the question template using
+#   "&{POINTS}".
+#
+# - Index : [int, optional] The ordering for this question.  This only
+#   has meaning with the question order is not randomized.
+#
+# - Before : ["all"|name|regex|list, optional] A selection of question
+#   names that this question must be before ("all" means this is the
+#   first question).
+#
+# - After : ["all"|name|regex|list, optional] a selection of question
+#   names that this question must be after ("all" means that this is the
+#   last question).
+#
+# - Follows : [name, optional] A name of a question that this must
+#   follow.  This question will come immediately after the named
+#   questions.  This is used to construct follow up questions.
+#
+# - Constants : [dict, optional] A dictionary that can be handed to
+#   `MakeConsts`
+#
+# - Variables : [dict, optional] A dictionary that can be handed to
+#   `MakeValues()`
+#
+# - Unique : [dict, optional] A dictionary that can be handed to
+#   `MakeConsts()`, but which has a special set of symantics.  The
+#   constants should be strings with &{name} and @{name} values.  When
+#   a question instance is generated these will be filled based on the
+#   variables and constants, and the checked that they are unique.  If
+#   the values are not unique, they variables will be updated, and the
+#   values checked again (if a unique set can't be found, it will
+#   eventually give up and raise an error)
+#
+# - Answers : [dict, required] A dictionary of answers to the
+#   question.  See the Answers class for details.
+#
+# - Text : [str, required] A template for the LaTeX that will be used
+#   to build the question.  Strings with the format &{name} will be
+#   substituted with the question is build.  In addition to Value
+#   objects defined for the question and exam.
+#
+# - Solution : [str, optional] A template for the LaTeX used to print
+#   the solution.
+#
+# - Figure : [str, optional] A pdf file name for a figure that will be
+#   included with the question.
+#
+class Question(object):
+    def __init__(self, d: dict):
+        self.configuration = d
+        self.name = "not-set"
+        self.points = 1
+        self.extraCredit = False
+        self.index = None
+        self.before = None
+        self.after = None
+        self.follows = None
+        self.constants = dict()
+        self.variables = dict()
+        self.unique = dict()
+        self.answers = dict()
+        self.text = "not-set"
+        self.figure = None
+        self.soln = "There is no solution."
+
+        # Check for required keys
+        if "Name" not in d: raise ValueError("Question must have name")
+        if "Text" not in d: raise ValueError("Question must have text")
+        if "Answers" not in d: raise ValueError("Question must have answers")
+        for k in d:
+            if "Name" == k: self.name = d[k]
+            elif "Points" == k: self.points = d[k]
+            elif "ExtraCredit" == k: self.extraCredit = d[k]
+            elif "Index" == k: self.index = int(d[k])
+            elif "Before" == k: self.before = d[k]
+            elif "After" == k: self.after = d[k]
+            elif "Follows" == k: self.follows = d[k]
+            elif "Constants" == k: self.constants = MakeConsts(d[k])
+            elif "Variables" == k: self.variables = MakeValues(d[k])
+            elif "Unique" == k: self.unique = MakeConsts(d[k])
+            elif "Answers" == k: self.answers = MakeAnswers(d[k])
+            elif "Figure" == k: self.figure = d[k]
+            elif "Text" == k:  self.text = d[k]
+            elif "Solution" == k: self.soln = d[k]
+            else:
+                print("Bad key",k,"in",d)
+                raise ValueError("Unknown key in question")
+
+        self.constants["NAME"] = ConstantValue("NAME",str(self.name))
+        self.constants["POINTS"] = ConstantValue("POINTS",str(self.points))
+        self.constants["TEXT"] = ConstantValue("TEXT",self.text)
+        if self.figure:
+            self.constants["FIGURE"] = ConstantValue("FIGURE",self.figure)
+        self.constants["SOLUTION"] = ConstantValue("SOLUTION",self.soln)
+
+        # A digest of the question description (see the build cache).
+        self.digest = Digest(d)
+
+        # The ordering constraints for the answers.
+        self.constraints = ConstraintIndex(self.answers)
+
+## The fields of a question needed to choose and order the questions.
+#
+# This is built from the question description, and is what is kept in
+# the index of the QuestionBank.  When the entry is saved in the parsed
+# configuration cache, the `offset` and `size` give where the pickled
+# description is saved.
+class QuestionEntry(object):
+    def __init__(self, d: dict):
+        if "Name" not in d: raise ValueError("Question must have name")
+        self.name = d["Name"]
+        self.index = None
+        if "Index" in d: self.index = int(d["Index"])
+        self.before = d.get("Before")
+        self.after = d.get("After")
+        self.follows = d.get("Follows")
+        # A digest of the question description (see the build cache).
+        self.digest = Digest(d)
+        self.offset = None
+        self.size = None
+
+## The question pool.
+#
+# This acts like a dictionary of Question objects by name, but the
+# Question is only built the first time it is used (i.e. when it is
+# drawn for a version), since a question bank can have many more
+# questions than are used by an exam.  The `index` has a QuestionEntry
+# for each question which is enough to choose and order the questions.
+# The question descriptions are either kept as parsed, or read from
+# the `data` of the parsed configuration cache.
+class QuestionBank(object):
+    def __init__(self):
+        self.index = dict()
+        self.questions = dict()
+        self.descriptions = dict()
+        self.data = None
+
+    def add(self, entry: QuestionEntry, description: dict = None) -> None:
+        self.index[entry.name] = entry
+        self.questions.pop(entry.name, None)
+        self.descriptions.pop(entry.name, None)
+        if description is not None:
+            self.descriptions[entry.name] = description
+
+    ## Return the description (the parsed YAML) for a question.
+    def description(self, name: str) -> dict:
+        if name in self.descriptions: return self.descriptions[name]
+        entry = self.index[name]
+        if entry.offset is None or self.data is None:
+            raise KeyError("No description for question " + name)
+        return pickle.loads(self.data[entry.offset:entry.offset+entry.size])
+
+    def __getitem__(self, name: str):
+        question = self.questions.get(name)
+        if question is None:
+            question = Question(self.description(name))
+            self.questions[name] = question
+        return question
+
+    def __contains__(self, name: str) -> bool: return name in self.index
+
+    def __iter__(self): return iter(self.index)
+
+    def __len__(self) -> int: return len(self.index)
+
+    ## Use the Question objects already built by another bank for the
+    ## questions that haven't changed (see WatchExam).
+    def reuse(self, other) -> None:
+        for name in other.questions:
+            entry = self.index.get(name)
+            if entry is None or entry.digest != other.index[name].digest:
+                continue
+            self.questions[name] = other.questions[name]
+
+    ## The unused descriptions aren't saved with the exam.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["descriptions"] = dict()
+        state["data"] = None
+        return state
+
+
+## Hold the description of how to choose the questions
+#
+# This produces a list with pairs (two element tuples).  The first
+# element of the tuple is name of the question sequence being
+# described, the second element is a dictionary with the keys "Choose"
+# which sets the number of questisons of this type to be choses, and
+# the second element is a "selection" of which questions to choose.
+class Questions(object):
+    def __init__(self, d : dict):
+        self.sequence = list()
+        for s in d:
+            if len(s) != 1:
+                raise ValueError("Invalid question group")
+            group = s.popitem()
+            self.sequence.append(group)
+
+## Hold the version specific fields.
+#
+# These can be read for a CSV file, or specified in the YAML file as
+# lists.  This is used to fill constant names that are changed for
+# each version of the exam.  The most common names are "LASTNAME",
+# "FIRSTNAME", and "SID" (student id), but the actual names are
+# specified in the YAML file describing the exam.
+class Versions(object):
+    # Construct a Versions object
+    #
+    # This takes a dictionary describing the versions.  The keys are
+    #
+    # - Defaults : A dictionary of default names (as the key) and
+    #   values.
+    #
+    # - List : Specifies a the fields and a list of "rows" to be used.
+    #   This is a dictionary with the keys
+    #
+    #   + Fields : A list of field names.  If a field name contains a
+    #     substring string "DUMMY", the field will not be processed.
+    #
+    #   + Values : A list of strings used to fill the fields.  Each
+    #     string is a different version of the exam, and should
+    #     containe a comma separated list of field values
+    #
+    # - CSVFile : a dictionary with the keys
+    #
+    #   + Name : the CSV file name.
+    #
+    #   + Fields : A list of the field names inside the CSV file.  If
+    #     a field name contains a substring string "DUMMY", the field
+    #     will not be processed.
+    #
+    def __init__(self, d):
+        # A list of dictionaries that are used for substitutions in the exam
+        self.inputs = list()
+        # A dictionary used to initialize a particular version dictionary.
+        self.defaults = dict()
+        # The CSV files that were read.
+        self.files = list()
+        if "List" in d: self.HandleList(d["List"])
+        if "CSVFile" in d: self.HandleCSV(d["CSVFile"])
+        if "Defaults" in d: self.defaults = d["Defaults"]
+
+    ## Implement parsing the List of versions from the YAML file
+    def HandleList(self, d):
+        fields = d["Fields"]
+        for line in d["Values"]:
+            vers = dict()
+            values = [v.strip() for v in line.split(",")]
+            for k, v in zip(fields,values):
+                # REJECT dummy fields
+                if 'DUMMY' in k: continue
+                if 'Dummy' in k: continue
+                if 'dummy' in k: continue
+                vers[k] = v
+            for k in self.defaults:
+                if k not in vers: vers[k] = self.defaults[k]
+            self.inputs.append(vers)
+
+    ## Implement reading the versions from a CSV file
+    def HandleCSV(self, d):
+        fields = d["Fields"]
+        file = d["Name"]
+        self.files.append(file)
+        try:
+            with io.open(file,"r",encoding="ascii",errors="ignore") as f:
+                reader = csv.DictReader(f,fieldnames=fields)
+                for v in reader:
+                    vers = dict()
+                    for k in fields:
+                        # REJECT dummy fields
+                        if 'DUMMY' in k: continue
+                        if 'Dummy' in k: continue
+                        if 'dummy' in k: continue
+                        vers[k] = v[k]
+                    for k in self.defaults:
+                        if k not in vers: vers[k] = self.defaults[k]
+                    self.inputs.append(vers)
+        except:
+            print("VERSIONS CSV FILE IS MISSING: ", file)
+            pass
+
+
+## The version of the parsed configuration cache (see Exam.loadConfiguration)
+PARSED_CACHE_VERSION = 2
+
+## Return the name of the parsed configuration cache for an input file.
+#
+# The cache is a pickle, so it is kept in a directory that belongs to
+# the user ($XDG_CACHE_HOME/exam-writer, or ~/.cache/exam-writer), and
+# not next to the input file where someone else could write it.  The
+# name depends on the input file and the working directory (which is
+# searched for the included files).
+def ParsedCacheName(name: str) -> str:
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base: base = os.path.join(os.path.expanduser("~"), ".cache")
+    key = os.getcwd() + "\0" + os.path.abspath(name)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(base, "exam-writer", digest + ".parsed")
+
+## Return true if a file (or directory) can only be changed by the user.
+def OwnedByUser(name: str) -> bool:
+    status = os.stat(name)
+    if hasattr(os, "getuid") and status.st_uid != os.getuid(): return False
+    return (status.st_mode & 0o022) == 0
+
+## Use the C YAML loader when it is available.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+## Hold a description of the exam.
+#
+# This is filled by parsing the top level of the YAML file.  It
+# accepts the name of the YAML file to read.  After the yaml file has
+# been read the elements are checked, and then used to fill the fields
+# of this object.  The `options` are used while reading the file (see
+# ExamOptions).
+class Exam(object):
+    def __init__(self, name: str, options = None):
+        if options is None: options = ExamOptions()
+        self.pool = QuestionBank()
+        # The (name, real name, mtime, size) of each file that was read.
+        self.includes = list()
+        self.configuration = self.loadConfiguration(name, options)
+        self.templates = dict()
+        self.constants = dict()
+        self.variables = dict()
+        for  block in self.configuration: self.topLevel(block)
+        # The (mtime, size) of the other files that were read (i.e. the
+        # versions CSV file), see FileStatus.
+        files = list()
+        if hasattr(self, "versions"): files = self.versions.files
+        self.dataFiles = FileStatus(files)
+        # The ordering constraints for the question pool.
+        self.constraints = ConstraintIndex(self.pool.index)
+        # The part of the LaTeX header that is the same for every copy.
+        self.preamble = SharedPreamble(self)
+
+    def topLevel(self, d):
+        if not type(d) is dict:
+            raise TypeError("Blocks must be dictionaries")
+
+        if "Title" in d: self.title = d["Title"]
+        elif "BaseName" in d: self.baseName = d["BaseName"]
+        elif "Constants" in d:
+            vals = MakeConsts(d["Constants"])
+            for key in vals:
+                if key in self.constants:
+                    raise ValueError("Duplicate constant value: " + key)
+                else:
+                    self.constants[key] = vals[key]
+        elif "Variables" in d:
+            vals = MakeValues(d["Variables"])
+            for key in vals:
+                if key in self.variables:
+                    raise ValueError("Duplicate global variable: " + key)
+                else:
+                    self.variables[key] = vals[key]
+        elif "Questions" in d: self.questions = Questions(d["Questions"])
+        elif "Versions" in d: self.versions = Versions(d["Versions"])
+        elif "Question" in d: self.buildQuestion(d["Question"])
+        elif "QuestionTemplate" in d:
+            self.questionTemplate = d["QuestionTemplate"]
+        elif "QuestionWithFigureTemplate" in d:
+            self.questionWithFigureTemplate = d["QuestionWithFigureTemplate"]
+        elif "AnswerTemplate" in d: self.answerTemplate = d["AnswerTemplate"]
+
+        elif "ExamTemplate" in d: self.examTemplate = d["ExamTemplate"]
+        elif "Prologue" in d: self.templates["PROLOGUE"] = d["Prologue"]
+        elif "Preamble" in d: self.templates["PREAMBLE"] = d["Preamble"]
+        elif "TitlePage" in d: self.templates["TITLEPAGE"] = d["TitlePage"]
+        elif "FrontMatter" in d:
+            self.templates["FRONTMATTER"] = d["FrontMatter"]
+        elif "QuestionBlock" in d:
+            self.templates["QUESTIONBLOCK"] = d["QuestionBlock"]
+        elif "BackMatter" in d: self.templates["BACKMATTER"] = d["BackMatter"]
+        elif "Epilogue" in d: self.templates["EPILOGUE"] = d["Epilogue"]
+
+        else:
+            print(d)
+            raise ValueError("Unknown key in exam file")
+
+    def buildQuestion(self, q : dict):
+        """Add a question to the pool
+
+        The Question is built when it is first used (see QuestionBank).
+        The question can also be a QuestionEntry from the parsed
+        configuration cache.
+
+        """
+        if type(q) is QuestionEntry:
+            self.pool.add(q)
+            return
+        if "Name" not in q: raise ValueError("Missing question name")
+        self.pool.add(QuestionEntry(q), q)
+
+    def findFile(self,name: str) -> str:
+        """Find the real name of an input file.
+
+        This searchs in a very limited path: the current working
+        directory, the templates subdirectory of the current working
+        directory, and the templates subdirectory of the script
+        location.
+
+        """
+        # Check in the current working directory
+        if os.path.isfile(name): return name
+        # Check in the config subdirectory of the current working directory
+        if os.path.isfile("./templates/"+name): return "./templates/" + name
+        # Check in the config subdirectory of the script location.
+        if os.path.isfile(os.path.dirname(__file__)+"/templates/"+name):
+            return os.path.dirname(__file__)+"/templates/"+name
+        # Give up!
+        raise ValueError("File not found")
+
+    def readFile(self,name: str, includes: list = None) -> str:
+        """Read the contents of a file and return it as a string.
+
+        The file "name" is read.  Any include files are included and
+        the total result is returned as a string.  If "includes" is
+        provided, then the (name, real name) of each file that is read
+        is added to it.
+
+        """
+
+        print("Looking for input file: ", name)
+        realName = self.findFile(name)
+        if includes is not None: includes.append((name, realName))
+
+        config  = ["###############################################\n"]
+        config += ["# Including: " + realName + "\n"]
+        config += ["###############################################\n"]
+
+        with open(realName,'r') as f:
+            for line in f:
+                if line.lstrip()[0:10] == "- Include:":
+                    config.append(self.readFile(line.split()[2], includes))
+                    continue
+                config.append(line)
+
+        config += ["###############################################\n"]
+        config += ["# End of: " + realName + "\n"]
+        config += ["###############################################\n"]
+
+        return "".join(config)
+
+    def loadConfiguration(self,name: str, options):
+        """Read the contents of a file and return as a list
+
+        The parsed configuration is cached in a ".parsed" file in the
+        user cache directory (see ParsedCacheName).  The cache is used
+        without reading the files if every included file is found in
+        the same place with the same modification time and size, and
+        is used without parsing if the text of the included files
+        hasn't changed.
+
+        """
+        cacheName = ParsedCacheName(name)
+        cache = None
+        # The cache doesn't have the question descriptions inline, so
+        # the input is parsed when it is dumped.
+        if (not options.dumpInput and not options.dumpYAML
+            and not options.force):
+            cache = self.readParsedCache(cacheName)
+        if cache is not None and self.includesUnchanged(cache["includes"]):
+            print("Using parsed configuration from", cacheName)
+            self.pool.data = cache["questions"]
+            self.includes = cache["includes"]
+            return cache["configuration"]
+        includes = list()
+        config = self.readFile(name, includes)
+        for include, realName in includes:
+            status = os.stat(realName)
+            self.includes.append((include, realName,
+                                  status.st_mtime, status.st_size))
+        if options.dumpInput: print(config)
+        digest = hashlib.sha1(config.encode("utf-8")).hexdigest()
+        if cache is not None and cache["digest"] == digest:
+            print("Using parsed configuration from", cacheName)
+            self.pool.data = cache["questions"]
+            input = cache["configuration"]
+        else:
+            input = yaml.load(config, Loader=YAML_LOADER)
+        if not options.dryRun:
+            self.writeParsedCache(cacheName, self.includes, digest, input)
+        if options.dumpYAML: print(yaml.dump(input))
+        return input
+
+    def readParsedCache(self,cacheName: str):
+        """Read the parsed configuration cache (or return None).
+
+        The file has a pickled dictionary with the included files, the
+        digest, and the configuration where each question is replaced
+        by a QuestionEntry.  The rest of the file has the pickled
+        question descriptions (at the offset in the QuestionEntry), and
+        is returned as "questions".
+
+        """
+        if not os.path.isfile(cacheName): return None
+        try:
+            # Don't unpickle a file that someone else could have written.
+            if not (OwnedByUser(cacheName)
+                    and OwnedByUser(os.path.dirname(cacheName))):
+                print("Ignoring unsafe parsed configuration", cacheName)
+                return None
+            with open(cacheName,"rb") as f:
+                cache = pickle.load(f)
+                cache["questions"] = f.read()
+        except Exception:
+            print("Ignoring bad parsed configuration", cacheName)
+            return None
+        if cache.get("version") != PARSED_CACHE_VERSION: return None
+        return cache
+
+    def dataUnchanged(self) -> bool:
+        """Check that the versions CSV files haven't been changed."""
+        return FileStatus(self.dataFiles) == self.dataFiles
+
+    def includesUnchanged(self,includes: list) -> bool:
+        """Check that the included files haven't been changed or moved."""
+        for name, realName, mtime, size in includes:
+            try:
+                if self.findFile(name) != realName: return False
+                status = os.stat(realName)
+            except (ValueError, OSError):
+                return False
+            if status.st_mtime != mtime or status.st_size != size:
+                return False
+        return True
+
+    def writeParsedCache(self,cacheName: str, includes: list, digest: str,
+                         input) -> None:
+        """Save the parsed configuration with the included files.
+
+        The build goes on without the cache if it can't be written.
+
+        """
+        configuration = list()
+        questions = list()
+        offset = 0
+        for block in input:
+            if type(block) is not dict or "Question" not in block:
+                configuration.append(block)
+                continue
+            q = block["Question"]
+            if type(q) is QuestionEntry:
+                # The input is from the old cache, so the questions are
+                # saved again at the same offsets.
+                data = self.pool.data[q.offset:q.offset+q.size]
+                offset += len(data)
+                questions.append(data)
+                configuration.append(block)
+                continue
+            entry = QuestionEntry(q)
+            data = pickle.dumps(q, protocol=pickle.HIGHEST_PROTOCOL)
+            entry.offset = offset
+            entry.size = len(data)
+            offset += len(data)
+            questions.append(data)
+            configuration.append({"Question": entry})
+        cache = {"version": PARSED_CACHE_VERSION, "includes": includes,
+                 "digest": digest, "configuration": configuration}
+        temporary = None
+        try:
+            directory = os.path.dirname(cacheName)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(prefix=".", dir=directory)
+            with os.fdopen(handle,"wb") as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+                for data in questions: f.write(data)
+            os.replace(temporary, cacheName)
+            temporary = None
+        except OSError as error:
+            print("Cannot write parsed configuration", cacheName, error)
+        finally:
+            if temporary is not None and os.path.isfile(temporary):
+                os.remove(temporary)
+
+################################################################
+#
+# Expand variables and expressions in a string.
+#
+################################################################
+
+## Expand all of the variable and mathematical expressions
+#
+# This takes an `input` string and a dictionary, `d`, and expands all
+# of the values and mathematical expressions.  The dictionary should
+# contain keys for all of the variables that are being replaced.
+# Instances of &{name} are replaced inside the input string using the
+# dictionary.  After all of the named variables are replaced, all
+# instances of @{expr}, and @[sigfig]{expr} are expanded.
+#
+# Templates to be replace:
+#
+# - &{name} : Looks up `name` in the input dictionary and replaces
+#         using that value.  For example if the dictionary contains
+#         `{"spelling" : "yellow"}` an input string of "a &{spelling}
+#         bee"  becomes "a yellow bee".
+#
+# - @{expr} : Applys eval to the expression (after all variables have
+#         been expanded.  For instance, "@{1+1}" becomes "2".  The
+#         expression can use "math" and a few builtin functions (see
+#         `CompileExpression()`).
+#
+# - @[sigfig]{expr} : After the expression has been evaluated, it is
+#         rounded to the number of significant figures.  For instance,
+#         "@[3]{1+1}" becomes "2.00".
+#
+# - @[sigfig(t|T)[expr] : Evaluate the expression and round the the
+#         requested significant figures, then translate into a LaTeX
+#         expression for the number in scientific notation.  For
+#         example, "@[2t]{3E+8}" is "\ensuremath{3.0\times{}10^{8}}"
+#
+def ExpandString(input: str, d: dict) -> str:
+    if not type(input) is str: raise TypeError("Can only expand a string")
+
+    # Render the compiled template in one pass.  Nested references are
+    # expanded as they are reached.
+    try:
+        result = CompileTemplate(input).Render(d)
+    except TemplateNotExact:
+        return ExpandStringSlowly(input, d)
+
+    # The rendered text can (rarely) contain new substitutions that
+    # were built across the boundary of a substituted value.  When
+    # that happens, finish with the original fixed point expansion so
+    # the semantics are unchanged.
+    if NeedsSubstitution(result, d): return ExpandStringSlowly(input, d)
+    value = result
+    result = ""
+    while result != value:
+        result = value
+        value = ExpandExpression(value)
+    return result
+
+## Expand the string by substituting until the value stops changing.
+#
+# This is the reference implementation of `ExpandString()`.  The
+# whole string is repeatedly substituted with string.Template until
+# it stops changing, and then the expressions are expanded until
+# there are none left.
+def ExpandStringSlowly(input: str, d: dict) -> str:
+    # Iteratively substitute strings until the value stops changing
+    value = str(input)
+    result = ""
+    while result != value:
+        result = value
+        value = ExpandTemplate(value).safe_substitute(d)
+
+    # Expand all of the expressions
+    value = result
+    result = ""
+    while result != value:
+        result = value
+        value = ExpandExpression(value)
+
+    return result
+
+## A sub-class to override the default behavior of string.Template
+class ExpandTemplate(string.Template): delimiter='&'
+
+## The regular expression to find an expression in a string.
+EXPRESSION = re.compile(r"@(\[([0-9tT]*)\]){0,1}\{([^{}]*)\}")
+
+## Expand all of the mathematical expressions in a string.
+#
+# See the ExpandString documentation for more details.
+def ExpandExpression(input: str) -> str:
+    parse = EXPRESSION.search(input)
+    if parse == None: return input
+    sigfig = parse[2]
+    if sigfig != None and len(sigfig) < 1: sigfig = None
+    expr = EvaluateExpression(parse[3],sigfig)
+    result = input[:parse.span()[0]] + expr + input[parse.span()[1]:]
+    return result
+
+## Evaluate the text of one expression and format the result.
+#
+# The `sigfig` string is handed to `SignificantFigures()`.
+def EvaluateExpression(text: str, sigfig) -> str:
+    code = CompileExpression(text)
+    try:
+        expr = eval(code, EXPRESSION_NAMESPACE)
+    except:
+        print("Expression error in:", text)
+        raise RuntimeError("Parse error")
+    return SignificantFigures(expr,sigfig)
+
+################################################################
+#
+# Compiled expressions.
+#
+# Each distinct expression is parsed and compiled once, and the
+# code object is cached.  The expressions are checked against a
+# restricted set of python syntax, and evaluated in a namespace that
+# only contains "math" and a few safe builtin functions.
+#
+################################################################
+
+## Strip the new lines from an expression.
+EXPRESSION_NEWLINES = str.maketrans('','','\n\r')
+
+## The names that are available when an expression is evaluated.
+EXPRESSION_NAMESPACE = {
+    "__builtins__": {
+        "abs": abs, "round": round, "min": min, "max": max,
+        "int": int, "float": float, "str": str, "len": len,
+        "sum": sum, "pow": pow, "divmod": divmod,
+        "True": True, "False": False, "None": None,
+    },
+    "math": math,
+}
+
+## The python syntax that can be used in an expression.
+EXPRESSION_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Attribute,
+    ast.Call, ast.keyword, ast.Subscript, ast.Slice, ast.Tuple, ast.List,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+    ast.JoinedStr, ast.FormattedValue,
+)
+
+## Return the compiled code for the text of an expression.
+#
+# The new lines are removed before the expression is parsed.  This
+# raises a RuntimeError if the expression can't be parsed, or uses
+# python syntax that isn't allowed (e.g. names starting with "_").
+@functools.lru_cache(maxsize=4096)
+def CompileExpression(text: str):
+    expr_string = text.translate(EXPRESSION_NEWLINES)
+    try:
+        tree = ast.parse(expr_string.strip(" \t"), mode="eval")
+    except SyntaxError:
+        print("Expression error in:", expr_string)
+        raise RuntimeError("Parse error")
+    for node in ast.walk(tree):
+        ok = isinstance(node, EXPRESSION_NODES)
+        if isinstance(node, ast.Name) and node.id.startswith("_"): ok = False
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            ok = False
+        if not ok:
+            print("Expression not allowed:", expr_string)
+            raise RuntimeError("Parse error")
+    return compile(tree, "<expression>", "eval")
+
+################################################################
+#
+# Compiled templates.
+#
+# A template string is parsed once into a list of nodes, and the
+# parsed template is cached so that each distinct string is only
+# parsed once no matter how many versions of the exam are built.
+#
+################################################################
+
+## The tokens found while compiling a template.
+#
+# - "&&" is an escaped "&".
+# - "&name" and "&{name}" are references (the same as string.Template).
+# - "@{" and "@[sigfig]{" start an expression.
+# - "{" and "}" are needed to find the end of an expression.
+TEMPLATE_TOKENS = re.compile(
+    r"&(?:(?P<escaped>&)|(?P<named>[_a-z][_a-z0-9]*)"
+    r"|\{(?P<braced>[_a-z][_a-z0-9]*)\})"
+    r"|@(?:\[(?P<sigfig>[0-9tT]*)\])?(?P<expression>\{)"
+    r"|(?P<brace>[{}])",
+    re.IGNORECASE | re.ASCII)
+
+## Raised when a template can't be expanded in one pass.
+class TemplateNotExact(Exception):
+    pass
+
+## A literal block of text in a template.
+class TemplateText(object):
+    def __init__(self, text: str):
+        self.text = text
+
+    def Render(self, d: dict, memo: dict, depth: int) -> str:
+        return self.text
+
+## A reference to a named value in a template (i.e. &{name}).
+#
+# The value is expanded before it is inserted.  A name that is not
+# in the dictionary is left in the text unchanged.
+class TemplateReference(object):
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+
+    def Render(self, d: dict, memo: dict, depth: int) -> str:
+        if self.name in memo:
+            # The memo is None while the value is being expanded, so
+            # the value refers to itself.  ExpandStringSlowly leaves
+            # that reference in the text.
+            if memo[self.name] is None: raise TemplateNotExact(self.text)
+            return memo[self.name]
+        if self.name not in d: return self.text
+        value = str(d[self.name])
+        if "&" in value or "@" in value:
+            memo[self.name] = None
+            value = CompileTemplate(value).RenderValue(d, memo, depth+1)
+        memo[self.name] = value
+        return value
+
+## An expression in a template (i.e. @[sigfig]{expr}).
+#
+# The body of the expression is rendered and then evaluated.  If the
+# rendered body contains a brace, then it isn't an expression (this
+# matches ExpandExpression) and the text is left unchanged.
+class TemplateExpression(object):
+    def __init__(self, sigfig, body: list):
+        self.sigfig = sigfig
+        self.body = body
+
+    def Render(self, d: dict, memo: dict, depth: int) -> str:
+        text = "".join([n.Render(d, memo, depth) for n in self.body])
+        if "{" in text or "}" in text:
+            sigfig = ""
+            if self.sigfig is not None: sigfig = "[" + self.sigfig + "]"
+            return "@" + sigfig + "{" + text + "}"
+        sigfig = self.sigfig
+        if sigfig != None and len(sigfig) < 1: sigfig = None
+        return EvaluateExpression(text, sigfig)
+
+## A compiled template.
+#
+# This holds the list of nodes for a template string.  Use
+# `CompileTemplate()` to get the (cached) compiled template for a
+# string.
+class CompiledTemplate(object):
+    def __init__(self, text: str):
+        self.text = text
+        self.nodes, pos, self.exact = ParseTemplate(text, 0, False)
+        self.openEnd = (len(self.nodes) > 0
+                        and type(self.nodes[-1]) is TemplateReference
+                        and not self.nodes[-1].text.startswith("&{"))
+
+    ## Expand the template using the dictionary `d`.
+    #
+    # The `memo` dictionary holds the expanded values for the names
+    # that have already been rendered.
+    def Render(self, d: dict, memo = None, depth: int = 0) -> str:
+        if depth > 100: raise RuntimeError("Recursive template: " + self.text)
+        if not self.exact: raise TemplateNotExact(self.text)
+        if memo is None: memo = dict()
+        if len(self.nodes) == 1: return self.nodes[0].Render(d, memo, depth)
+        return "".join([n.Render(d, memo, depth) for n in self.nodes])
+
+    ## Expand the template as the value of a name.  A value that ends
+    ## with an unbraced name (i.e. &name) can run into the text after
+    ## it (ExpandStringSlowly sees "&name" followed by that text), so
+    ## it isn't expanded in one pass.
+    def RenderValue(self, d: dict, memo: dict, depth: int) -> str:
+        if self.openEnd: raise TemplateNotExact(self.text)
+        return self.Render(d, memo, depth)
+
+## Return the compiled template for the string.
+@functools.lru_cache(maxsize=1024)
+def CompileTemplate(text: str) -> CompiledTemplate:
+    return CompiledTemplate(text)
+
+## Parse the template `text` starting at `pos`.
+#
+# This returns a tuple of the list of nodes, the position after the
+# parsed text, and a flag that is false if the one pass expansion
+# might not match `ExpandStringSlowly()`.  If `inExpression` is true,
+# then parsing stops after the closing brace of the expression, and
+# `None` is returned for the nodes when the text is not a valid
+# expression.
+def ParseTemplate(text: str, pos: int, inExpression: bool):
+    nodes = []
+    literal = []
+    exact = True
+    while True:
+        token = TEMPLATE_TOKENS.search(text, pos)
+        if token is None:
+            if inExpression: return None, pos, exact
+            chunk = text[pos:]
+            if "&{" in chunk or chunk.endswith("&"): exact = False
+            literal.append(chunk)
+            break
+        # Any "&" in the chunk is not part of a token.  It needs to
+        # stay that way after the following text is substituted.
+        chunk = text[pos:token.start()]
+        if "&{" in chunk: exact = False
+        if chunk.endswith("&") and token[0] == "{": exact = False
+        literal.append(chunk)
+        pos = token.end()
+        if token["escaped"] is not None:
+            # The "&" will be seen again by the next substitution, so
+            # it needs to be followed by something harmless.
+            if pos >= len(text) or text[pos] in "&{_" or text[pos].isalpha():
+                exact = False
+            literal.append("&")
+            continue
+        if token["brace"] is not None:
+            if not inExpression:
+                literal.append(token["brace"])
+                continue
+            if token["brace"] == "{": return None, pos, exact
+            break
+        literal = "".join(literal)
+        if literal: nodes.append(TemplateText(literal))
+        literal = []
+        if token["expression"] is None:
+            name = token["named"] or token["braced"]
+            nodes.append(TemplateReference(name, token[0]))
+            continue
+        body, end, bodyExact = ParseTemplate(text, pos, True)
+        if body is None:
+            # Not an expression, so the "@" is just text.
+            literal.append("@")
+            pos = token.start() + 1
+            continue
+        nodes.append(TemplateExpression(token["sigfig"], body))
+        exact = exact and bodyExact
+        pos = end
+    literal = "".join(literal)
+    if literal: nodes.append(TemplateText(literal))
+    return nodes, pos, exact
+
+## Check if a substitution would change the string.
+def NeedsSubstitution(text: str, d: dict) -> bool:
+    if "&" not in text: return False
+    for token in TEMPLATE_TOKENS.finditer(text):
+        if token["escaped"] is not None: return True
+        name = token["named"] or token["braced"]
+        if name is not None and name in d: return True
+    return False
+
+## The regular expression to split a number in scientific notation.
+SCIENTIFIC = re.compile("([0-9.]*)[Ee]([+-])([0-9]*)")
+
+## Apply the significant figure rounding to the input value
+#
+# If the string `sigfig` contains T or t, the number is translated
+# into a form suitable for LaTeX.
+def SignificantFigures(input,sigfig) -> str:
+    latex = False
+    general = False
+    if sigfig == None: sigfig = ""
+    if "g" in str(sigfig):
+        general = True
+        sigfig = sigfig.replace("g","")
+    if "G" in str(sigfig):
+        general = True
+        sigfig = sigfig.replace("G","")
+    if "t" in str(sigfig):
+        latex = True
+        sigfig = sigfig.replace("t","")
+    if "T" in str(sigfig):
+        latex = True
+        sigfig = sigfig.replace("t","")
+    if len(sigfig) < 1: value = str(input)
+    else: value = ("{:#." + str(int(sigfig)) + "g}").format(input)
+    if general: value = ("{:g}").format(float(value))
+    if not latex: return value.rstrip(".")
+    # Turn the value into a LaTeX number
+    mantSign = ""
+    if value[0] == '-':
+        mantSign = "-"
+        value = value[1:]
+    parse = SCIENTIFIC.search(value)
+    if not parse:
+        value = value.rstrip(".")
+        return mantSign+value
+    mant = parse.group(1).rstrip(".")
+    sign = parse.group(2)
+    if sign == "+": sign = ""
+    expo = parse.group(3).lstrip("0")
+    value  = "\\ensuremath{" + mantSign +  mant +"\\times{}10^{" + sign + expo +"}}"
+    return value
+
+################################################################
+# Build a list of keys from an input dictionary based on a selection
+# criteria.  The ordering must be "Before", or "After", The input
+# selection will have a value of
+#   "all" -- means that everything in the input dictionary is selected
+#            Except it needs to exclude the current element if the element
+#            is in the dictionary.  It's also an error if "all" happens
+#            more than once.  It also excludes any element that has a
+#            "Follows" key.
+#   "aName" -- a string interpreted as a regular expression
+#   ["name1", "name2, ...] -- a list of regular expressions
+################################################################
+def BuildSelection(selection, d: dict) -> list:
+    if selection is None: return list()
+    if selection == "all": return SelectAll(selection,d)
+    if type(selection) is str: return SelectName(selection,d)
+    if type(selection) is list: return SelectList(selection,d)
+    raise ValueError("Selection is not valid")
+
+def SelectAll(selection, d: dict) -> list:
+    out = []
+    for k in d:
+        if d[k].follows is not None: continue
+        out.append(k)
+    return out
+
+def SelectName(selection, d: dict) -> list:
+    out = []
+    pattern = re.compile(selection)
+    for k in d:
+        if d[k].follows is not None: continue
+        if pattern.fullmatch(k) != None: out.append(k)
+    return out
+
+def SelectList(selection, d: dict) -> list:
+    out = []
+    for name in selection:
+        out += SelectName(name, d)
+    return out
+
+## Build a list of key names matching the selection
+#
+# This selects all of the keys in a dictionary that match a selection
+# criteria.  The selection criteria can be None, string, or a list
+# of strings.
+#
+# - selection -- This is a selection criteria that will be applied
+#                     to the dictionary.  The possible values are
+#
+#   + None  : No keys are selected
+#
+#   + "all" : Select all keys in the dictionary, except keys which
+#                         contain "all" in the "after" field
+#
+#   + "name" : A regular expression (usually this is just a name).
+#                        This selects all of the keys matching the
+#                        regular expression, except keys containing
+#                        "all" in the "before" field
+#
+#   + list   : A list of regular expressions following the
+#                        same rules as "name"
+#
+# -d -- A dictionary.  The elements of the dictionary should also be
+#                     dictionaries, and may contain the "before" and
+#                     "after" fields.
+#
+# Return Value: A list of dictionary keys that match the selection
+#         criteria.
+def BuildBefore(selection, d: dict) -> list:
+    if selection is None: return list()
+    if selection == "all": return BuildBeforeAll(d)
+    if type(selection) is str: return BuildBeforeRegEx(selection,d)
+    if type(selection) is list: return BuildBeforeList(selection,d)
+    raise ValueError("Selection is not valid")
+
+# Build a list of all keys except those that have entries with: "all"
+# in the before field; or, have a "follows" field.
+def BuildBeforeAll(d: dict) -> list:
+    out = []
+    allCount = 0   # More than one "all" is OK, maybe(!)
+    for k in d:
+        if d[k].before is not None and d[k].before == "all":
+            allCount += 1
+            continue
+        if d[k].follows is not None: continue
+        out.append(k)
+    return out
+
+# Build a list of keys that match the name (a regular expression
+# string).  This will not contain keys for items with "all" in the
+# before field, or which contain a "follows" field
+def BuildBeforeRegEx(name: str, d: dict) -> list:
+    out = []
+    for k in d:
+        if d[k].before is not None and d[k].before == "all": continue
+        if d[k].follows is not None: continue
+        if re.fullmatch(name,k) != None: out.append(k)
+    return out
+
+# Apply BuildBeforeRegEx to a list of strings.
+def BuildBeforeList(names: list, d: dict) -> list:
+    out = []
+    for name in names:
+        out += BuildBeforeRegEx(name, d)
+    return out
+
+## Build a list of keys matching the selection
+#
+#    Arguments:
+#        selection -- This is a selection criteria that will be applied
+#                     to the dictionary.  The possible values are
+#                 None  : No keys are selected
+#                 "all" : Select all keys in the dictionary, except
+#                         keys which contain "all" in the "After" field
+#                 "name" : A regular expression for a single name
+#                        (usually this is just a constant string)
+#                 list   : A list of regular expressions following the
+#                        same rules as "name"
+#        d -- A dictionary.  The elements of the dictionary should also
+#                     be dictionaries, and may contain the "After"
+#                     field.
+#
+#    Return Value: A list of dictionary keys that match the selection
+#         criteria.
+def BuildAfter(selection, d: dict) -> list:
+    if selection is None: return list()
+    if selection == "all": return BuildAfterAll(d)
+    if type(selection) is str: return BuildAfterRegEx(selection,d)
+    if type(selection) is list: return BuildAfterList(selection,d)
+    raise ValueError("Selection is not valid")
+
+def BuildAfterAll(d: dict) -> list:
+    out = []
+    allCount = 0   # More than one "all" is OK, maybe(!)
+    for k in d:
+        if d[k].after == "all":
+            allCount += 1
+            continue
+        if d[k].follows != None: continue
+        out.append(k)
+    return out
+
+def BuildAfterRegEx(name: str, d: dict) -> list:
+    out = []
+    for k in d:
+        if d[k].after == "all": continue
+        if d[k].follows != None: continue
+        if re.fullmatch(name,k) != None: out.append(k)
+    return out
+
+def BuildAfterList(names: list, d: dict) -> list:
+    out = []
+    for name in names:
+        out += BuildAfterRegEx(name, d)
+    return out
+
+## Choose a list of object from a pool of Question or Answer objects.
+#
+# This builds a list of up to `count` objects from the `pool` based on
+# the `selection`.  If the pool has fewer than `count` objects, then
+# all of them will be used.  The `pool` must be a dictionary of
+# objects with `name` and `follows` fields.  Any question that follows
+# a chosen question is also chosen.
+#
+# The `ChooseFromPool()` function makes sure that when an object
+# (i.e. a Question or Answer) is chosen, any follow questions are also
+# chosen.  This causes a minor "feature" at the very end of list of
+# chosen objects since the object cannot have a follow-up since that
+# would make the list too long.  If adding a follow up will make the
+# list to long, the object and its follow-up(s) are skipped.  The
+# choices are in the pool order when `shuffle` is false.
+def ChooseFromPool(pool, selection, count = 999, rng = random, index = None,
+                   shuffle = True):
+    if index is None: index = ConstraintIndex(pool)
+    # Find all the questions in the pool that match the selection and
+    # shuffle the order.
+    choices = list(index.Select(selection))
+    if shuffle: rng.shuffle(choices)
+    # Add questions to the output starting from the first chosen question
+    out = []
+    for choice in choices:
+        # See if the current choice will fit into the output.  Add any
+        # questions that must follow the choice to the trial.
+        trial = [choice] + index.chains[choice]
+        # Make sure the trial doesn't make the output too long.  If
+        # the output would be to long, then skip the choice.
+        if len(out) + len(trial) > count: continue
+        # The length is OK, so add the trial to the output
+        out += trial
+        if len(out) >= count: break
+    return out
+
+## Sort a list so that all of the "before" constraints are met.
+#
+# This is a topological sort of the `ordered` list where `before[c]`
+# is a list of the names that `c` must come before.  When more than
+# one name could come next, the one that is earliest in the `ordered`
+# list is used, so the result is the input order, minimally adjusted
+# to meet the constraints.  A ValueError is raised if the constraints
+# contain a cycle.
+def SortChosen(ordered: list, before: dict) -> list:
+    position = {c: i for i, c in enumerate(ordered)}
+    sorter = TopologicalSorter()
+    for c in ordered:
+        sorter.add(c)
+        for cand in before[c]:
+            if cand in position: sorter.add(cand, c)
+    try:
+        sorter.prepare()
+    except CycleError as error:
+        print("Cycle in Before/After constraints:", error.args[1])
+        raise ValueError("Ordering constraints have a cycle")
+    out = []
+    ready = []
+    while sorter.is_active():
+        for c in sorter.get_ready(): heapq.heappush(ready, (position[c], c))
+        i, c = heapq.heappop(ready)
+        out.append(c)
+        sorter.done(c)
+    return out
+
+## Order the values in the chosen list.
+#
+# This applies the "Before", "After", and "Follows" constraints to the
+# chosen list.  NOTE: This only looks in the input list, so if there
+# is a question that should follow another, but it is not in the input
+# list, it still won't be in the output list.
+def OrderChosen(input, pool, rng = random, index = None, shuffle = True):
+    if index is None: index = ConstraintIndex(pool)
+    chosen = input
+    if shuffle: rng.shuffle(chosen)
+    following = dict()
+    # A list of strings with the "before" constraint applied.  This
+    # starts in the randomized order, and then gets (minimally)
+    # adjusted to meet the constraints.
+    ordered = list()
+    for c in chosen:
+        leader = index.pool[c].follows
+        if leader is None: ordered.append(c)
+        elif leader in following: following[leader].append(c)
+        else: following[leader] = [c]
+    # Reorder so all of the "before" constraints are met.
+    ordered = SortChosen(ordered, index.successors)
+    # Add back stuff in the follows list.
+    out = []
+    for elem in ordered:
+        stack = [elem]
+        while stack:
+            out.append(stack.pop())
+            stack += reversed(following.get(out[-1], []))
+    return out
+
+## An index of the ordering constraints for a pool.
+#
+# The pool is a dictionary of Question or Answer objects (i.e. the
+# Exam question pool, or the answers for a Question).  The selections
+# and constraints don't change between versions of the exam, so they
+# are resolved once when the exam is loaded.  The index has
+#
+# - chains : A dictionary from a name to the list of names that must
+#   follow it (i.e. the follow-up, and the follow-up to the follow-up).
+#
+# - successors : A dictionary from a name to the set of names that
+#   must come after it (from the "Before" and "After" fields).
+#
+class ConstraintIndex(object):
+    def __init__(self, pool: dict):
+        self.pool = pool
+        self.selections = dict()
+        follows = dict()
+        for k in pool:
+            if pool[k].follows != None: follows[pool[k].follows] = k
+        self.chains = dict()
+        for k in pool:
+            chain = []
+            last = k
+            while last in follows:
+                last = follows[last]
+                # Stop if the follows make a loop.
+                if last == k or last in chain: break
+                chain.append(last)
+            self.chains[k] = chain
+        self.successors = {k: set() for k in pool}
+        for k in pool:
+            if pool[k].follows is None:
+                self.successors[k].update(BuildBefore(pool[k].before,pool))
+            for cand in BuildAfter(pool[k].after,pool):
+                self.successors[cand].add(k)
+        for k in pool: self.successors[k].discard(k)
+
+    ## Return the list of names matching a selection.
+    #
+    # The selection is a regular expression, a list of regular
+    # expressions, or "all" (see BuildSelection).  The answer is
+    # cached, so each selection is only resolved once.
+    def Select(self, selection) -> list:
+        key = selection
+        if type(key) is list: key = tuple(key)
+        if key not in self.selections:
+            self.selections[key] = BuildSelection(selection, self.pool)
+        return self.selections[key]
+
+######################################################################
+## Return a random number generator for a seed and a list of names.
+#
+# The generator is seeded with the `seed` and the `names` so that each
+# copy of the exam (or variable) gets an independent, reproducible
+# stream of random numbers.  If `seed` is None, then the `random`
+# module is returned.
+def SeededRandom(seed, *names):
+    if seed is None: return random
+    return random.Random("-".join([str(n) for n in (seed,) + names]))
+
+## Read the seed from an existing answer key.
+#
+# This returns None if the key doesn't exist or doesn't have a seed.
+def ReadKeySeed(filename: str):
+    if not os.path.isfile(filename): return None
+    with open(filename,"r") as f:
+        for row in csv.DictReader(f):
+            if row.get("Seed"): return int(row["Seed"])
+    return None
+
+## The random variable values for every version of the exam.
+#
+# Every variable in the exam (the global variables, and the variables
+# for each question in the pool) draws the values for all of the
+# versions at once.  The ExamInstance for a version then takes its
+# values from the `index` of the version (`copy - 1`).
+#
+# If a `seed` is provided, each variable gets a random number
+# generator seeded from the `seed` and the variable name.  The values
+# for a version then don't depend on the other variables, or on
+# `count`, so any version can be rebuilt by itself.
+class VariableSamples(object):
+    def __init__(self, exam, count: int, seed=None):
+        self.count = count
+        self.globals = dict()
+        for k in exam.variables:
+            rng = SeededRandom(seed, "Variables", k)
+            self.globals[k] = exam.variables[k].sample(count, rng)
+        # The question variables are sampled when the question is
+        # first drawn.
+        self.exam = exam
+        self.seed = seed
+        self.questions = dict()
+
+    ## Return a dictionary of the global variable values for a version.
+    def Globals(self, index: int) -> dict:
+        return {k: self.globals[k][index] for k in self.globals}
+
+    ## Return a dictionary of the question variable values for a version.
+    def Question(self, name: str, index: int) -> dict:
+        draws = self.questions.get(name)
+        if draws is None:
+            variables = self.exam.pool[name].variables
+            draws = dict()
+            for k in variables:
+                rng = SeededRandom(self.seed, name, k)
+                draws[k] = variables[k].sample(self.count, rng)
+            self.questions[name] = draws
+        return {k: draws[k][index] for k in draws}
+
+######################################################################
+# The shared preamble.
+#
+# The start of the LaTeX header (the PROLOGUE and PREAMBLE) is usually
+# the same for every copy.  That part is dumped once into a LaTeX
+# format using mylatexformat, and each copy marks where the shared
+# part ends with "\csname endofdump\endcsname" (which does nothing
+# when the copy is compiled without the format).
+######################################################################
+
+FORMAT_DUMP_MARK = "\\csname endofdump\\endcsname\n"
+
+## Return the start of the LaTeX header that is the same for every copy.
+#
+# The exam template is expanded with only the templates, constants and
+# title, so anything that depends on the copy is left unexpanded.  The
+# shared part stops before the first unexpanded reference, and is cut
+# back to the last blank line outside of any braces so the format gets
+# complete LaTeX.  This returns an empty string if nothing is shared.
+def SharedPreamble(exam) -> str:
+    if not hasattr(exam,"examTemplate"): return ""
+    d = dict()
+    for k in exam.templates: d[k] = exam.templates[k]
+    for k in exam.constants: d[k] = exam.constants[k].get()
+    d["TITLE"] = str(getattr(exam,"title",""))
+    try:
+        header = ExpandString(exam.examTemplate, d)
+    except Exception:
+        return ""
+    # The preamble can't include \begin{document}, or anything that
+    # depends on the copy (or if the solutions are printed).  The
+    # running heading (\markboth) usually has the student name.
+    stops = ("\\begin{document}", "\\markboth", "printSolutions", "&",
+             "@{", "@[")
+    shared = ""
+    depth = 0
+    position = 0
+    for line in header.splitlines(keepends=True):
+        code = re.sub(r"(?<!\\)%.*", "", line)
+        if any(stop in code for stop in stops): break
+        position += len(line)
+        depth += code.count("{") - code.count("\\{")
+        depth -= code.count("}") - code.count("\\}")
+        if depth == 0 and line.strip() == "": shared = header[:position]
+    if "\\documentclass" not in shared: return ""
+    return shared
+
+######################################################################
+## An instance of the exam.
+#
+# This holds all of the information necessary to produce one version
+# of the exam
+class ExamInstance(object):
+    ## A dictionary of version specifier values to be substituted in
+    ## this version.  If `samples` (a VariableSamples object) is
+    ## provided, the variable values are taken from it.  If `seed` is
+    ## provided, the random choices for this version come from a
+    ## generator seeded with the `seed` and the `copy` number.  If
+    ## `allQuestions` is true, every question and answer is used in
+    ## the input order.
+    def __init__(self,exam,version,copy,samples=None,seed=None,
+                 allQuestions=False):
+        self.exam = exam
+        self.copy = copy
+        self.seed = seed
+        self.allQuestions = allQuestions
+        rng = SeededRandom(seed, copy)
+        self.name = str(exam.baseName) + "-" + str(copy).zfill(4)
+        self.version = version
+        self.questionList = []
+        self.globals = dict()
+
+        # Fill the global instances with the constants and variables values
+        for k in exam.templates: self.globals[k] = exam.templates[k]
+        for k in exam.constants: self.globals[k] = exam.constants[k].get()
+        draws = dict()
+        if samples is not None: draws = samples.Globals(copy-1)
+        for k in exam.variables:
+            self.globals[k] = exam.variables[k].get(draws.get(k), rng)
+
+        # Turn the version information into constant values and copy
+        # into the global instances.  The order is important so that
+        # the version information overrides the constants and
+        # variables.
+        v = dict()
+        for k in version: v[k] = ConstantValue(k,version[k])
+        v["TITLE"] = ConstantValue("TITLE",str(self.exam.title))
+        v["COPY"] = ConstantValue("TITLE",str(self.copy))
+        for k in v: self.globals[k] = v[k].get()
+
+        # Choose the questions for this version of the exam.
+        chosen = []
+        for k,n in self.exam.questions.sequence:
+            if allQuestions: count = 9999
+            elif "Choose" in n: count = n["Choose"]
+            else: count = 9999
+            if "Choices" not in n: raise ValueError("Missing question choices")
+            chosen += ChooseFromPool(self.exam.pool.index, n["Choices"],
+                                     count, rng, self.exam.constraints,
+                                     not allQuestions)
+
+        chosen = OrderChosen(chosen,self.exam.pool.index,rng,
+                             self.exam.constraints,not allQuestions)
+
+        out = "Version " + str(self.copy) + " -- "
+        for choice in chosen:
+            out += " " + choice
+        wrapper = textwrap.TextWrapper(subsequent_indent = "      ")
+        print(wrapper.fill(out))
+
+        # Fill the question list
+        for item in range(0,len(chosen)):
+            choice = chosen[item]
+            q = self.exam.pool[choice]
+            ok = False
+            brake = 10
+            draws = None
+            if samples is not None: draws = samples.Question(choice,copy-1)
+            while not ok and brake > 0:
+                question = QuestionInstance(self,q,item+1,draws,rng)
+                ok = question.ValidateQuestion()
+                brake = brake - 1
+                draws = None
+            if brake < 1: raise RuntimeError("Can't find good answers")
+            self.questionList.append(question)
+
+        # The questions are expanded when the exam is written (see
+        # StreamExam).
+        self.globals["QUESTIONS"] = QuestionStream(self)
+
+    ## Return the LaTeX for this version.  The end of the shared
+    ## preamble is marked so the copy can be compiled with a
+    ## precompiled format (see BuildFormat).
+    def MakeExam(self) -> str:
+        try:
+            return "".join(self.StreamExam())
+        except TemplateNotExact:
+            pass
+        exam = self.exam.examTemplate
+        exam = ExpandString(exam,self.globals)
+        shared = getattr(self.exam,"preamble","")
+        if shared and exam.startswith(shared):
+            exam = shared + FORMAT_DUMP_MARK + exam[len(shared):]
+        return exam
+
+    ## Generate the LaTeX for this version in pieces.
+    ##
+    ## This gives the same text as MakeExam, but each question is
+    ## expanded as it is reached, so the whole exam is never held in
+    ## memory.  The pieces are only finished (see ExpandString) at
+    ## boundaries where the expressions and substitutions can't cross
+    ## from one piece to the next (see SafeBoundary).  This raises
+    ## TemplateNotExact when the exam needs to be expanded with
+    ## ExpandStringSlowly (MakeExam does that).
+    def StreamExam(self):
+        shared = getattr(self.exam,"preamble","")
+        start = []
+        for piece in SafePieces(self.RenderPieces()):
+            text = self.FinishPiece(piece)
+            if start is None:
+                yield text
+                continue
+            # Hold the start of the exam until the end of the shared
+            # preamble can be marked.
+            start.append(text)
+            text = "".join(start)
+            if len(text) < len(shared): continue
+            start = None
+            if shared and text.startswith(shared):
+                text = shared + FORMAT_DUMP_MARK + text[len(shared):]
+            yield text
+        if start is not None:
+            text = "".join(start)
+            if shared and text.startswith(shared):
+                text = shared + FORMAT_DUMP_MARK + text[len(shared):]
+            if text: yield text
+
+    ## Generate the expanded exam template in pieces.  This is the same
+    ## as CompiledTemplate.Render, except that the templates that are
+    ## referenced, and each of the questions, are separate pieces.
+    def RenderPieces(self, template = None, depth: int = 0, memo = None):
+        if template is None: template = CompileTemplate(self.exam.examTemplate)
+        if depth > 100:
+            raise RuntimeError("Recursive template: " + template.text)
+        if not template.exact: raise TemplateNotExact(template.text)
+        if memo is None: memo = dict()
+        for node in template.nodes:
+            if type(node) is not TemplateReference or node.name in memo:
+                yield node.Render(self.globals, memo, depth)
+                continue
+            value = self.globals.get(node.name)
+            if type(value) is QuestionStream:
+                # The name is in progress while the pieces are expanded
+                # (see TemplateReference.Render).
+                memo[node.name] = None
+                questions = (q.MakeQuestion() for q in self.questionList)
+                for value in SafePieces(questions):
+                    if "&" in value or "@" in value:
+                        value = CompileTemplate(value).RenderValue(
+                            self.globals, memo, depth+1)
+                    yield value
+                del memo[node.name]
+            elif value is not None and "&" in str(value):
+                value = CompileTemplate(str(value))
+                if value.openEnd: raise TemplateNotExact(value.text)
+                memo[node.name] = None
+                yield from self.RenderPieces(value, depth+1, memo)
+                del memo[node.name]
+            else:
+                yield node.Render(self.globals, memo, depth)
+
+    ## Finish expanding a piece of the exam (see ExpandString).
+    def FinishPiece(self, value: str) -> str:
+        if NeedsSubstitution(value, self.globals):
+            raise TemplateNotExact(value)
+        result = ""
+        while result != value:
+            result = value
+            value = ExpandExpression(value)
+        return result
+
+    def ValidateExam(self):
+        print("Validate",self.name)
+        validExam = True
+        for q in self.questionList:
+            if not q.ValidateQuestion():
+                validExam = False
+                print("Invalid question", q.QuestionName())
+        return validExam
+
+    ## Return a CSV line suitable for including in an answer key
+    def MakeKey(self,header=False) -> str:
+        key = ""
+        if header:
+            key += "\"Copy\""
+            key += ","
+            key += "\"Questions\""
+            key += ","
+            key += "\"Answers\""
+            key += ","
+            key += "\"Basename\""
+            key += ","
+            key += "\"QuestionNames\""
+            key += ","
+            key += "\"Seed\""
+            for k in self.version: key += ",\"" + k + "\""
+            key += "\n"
+            return key
+        key += str(self.copy)
+        key += "," + str(len(self.questionList))
+        key += ",\""
+        for q in self.questionList: key += q.CorrectAnswer() + ";"
+        key += "\""
+        key += ",\"" + self.name + "\""
+        key += ",\""
+        for q in self.questionList: key += q.QuestionName() + ";"
+        key += "\""
+        seed = getattr(self, "seed", None)
+        if seed is None: seed = ""
+        key += ",\"" + str(seed) + "\""
+        for k in self.version: key += ",\"" + str(self.version[k]) + "\""
+        key += "\n"
+        return key
+
+    ## Return a CSV line with the answer name for each letter of each
+    ## question.  The questions are separated by ";" (in the same order
+    ## as the key), and the answers are separated by "," in letter
+    ## order.  This lets the grader find which answer was chosen.
+    def MakeChoices(self,header=False) -> str:
+        if header: return "\"Copy\",\"Basename\",\"AnswerNames\"\n"
+        choices = str(self.copy)
+        choices += ",\"" + self.name + "\""
+        choices += ",\""
+        for q in self.questionList: choices += q.AnswerNames() + ";"
+        choices += "\"\n"
+        return choices
+
+## The questions for a version of the exam (i.e. &{QUESTIONS}).
+#
+# The questions are expanded when they are written (see StreamExam),
+# so the text for all of the questions isn't kept in the ExamInstance.
+# Converting this to a string gives the text of all of the questions.
+class QuestionStream(object):
+    def __init__(self, examInstance):
+        self.examInstance = examInstance
+
+    def __str__(self):
+        return "".join(q.MakeQuestion()
+                       for q in self.examInstance.questionList)
+
+## Return true if an expanded piece of the exam can be finished by
+## itself.
+#
+# A substitution (&name) or expression (@{expr}) can only continue
+# into the next piece if it starts after the last closing brace.
+def SafeBoundary(text: str) -> bool:
+    tail = text[text.rfind("}")+1:]
+    return "&" not in tail and "@" not in tail
+
+## Join the pieces of text so that each one ends at a SafeBoundary.
+def SafePieces(pieces):
+    buffer = []
+    safe = True
+    for piece in pieces:
+        buffer.append(piece)
+        if "}" in piece: safe = SafeBoundary(piece)
+        else: safe = safe and SafeBoundary(piece)
+        if not safe: continue
+        yield "".join(buffer)
+        buffer = []
+    if buffer: yield "".join(buffer)
+
+## This holds all of the information necessary to produce one question.
+#
+# This is built from a Question object and represents one particular
+# version of the question.  The Question object should be treated as
+# immutable since it will be shared by all ExamInstance objects.  The
+# QuestionInstance is not shared between exams.
+#
+class QuestionInstance(object):
+    def __init__(self, examInstance, question, number, draws=None,
+                 rng=random):
+        self.question = question
+        self.number = number
+        self.examInstance = examInstance
+        self.exam = self.examInstance.exam
+        self.answerList = []
+        self.correctAnswer = ""
+        self.locals = dict()
+
+        # Copy the global instances into the local scope and then
+        # override with the question constants and variables.
+        ok = False
+        self.locals.update(examInstance.globals)
+        self.UpdateVariables(draws, rng)
+        self.AddUniques(rng)
+
+        # Choose and order the answers.  Always select all answers!
+        shuffle = not examInstance.allQuestions
+        chosen = ChooseFromPool(self.question.answers,".*",9999,rng,
+                                self.question.constraints,shuffle)
+
+        chosen = OrderChosen(chosen,self.question.answers,rng,
+                             self.question.constraints,shuffle)
+
+        # Fill the question list
+        correct = False
+        item = "ABCDEFGHIJKLMN"  # Should be from exam!
+        for i in range(0,len(chosen)):
+            choice = chosen[i]
+            a = self.question.answers[choice]
+            if a.correct:
+                self.correctAnswer += item[i]
+                correct = True
+            self.answerList.append(AnswerInstance(self,a,item[i]))
+        if not correct: raise RuntimeError("Question without a correct answer")
+
+        answers = ""
+        for answer in self.answerList: answers += answer.MakeAnswer()
+        self.locals["ANSWERS"] = str(answers)
+        self.locals["NUMBER"] = str(self.number)
+
+    ## Fill the question constants and variables.
+    #
+    # The `draws` dictionary can provide values for the variables
+    # (see VariableSamples), otherwise new values are generated with
+    # the random number generator `rng`.
+    def UpdateVariables(self, draws=None, rng=random):
+        if draws is None: draws = dict()
+        for k in self.question.constants:
+            self.locals[k] = self.question.constants[k].get()
+        for k in self.question.variables:
+            self.locals[k] = self.question.variables[k].get(draws.get(k),
+                                                            rng)
+
+    def AddUniques(self, rng=random):
+        brake = 100
+        uniqueOK = False
+        while not uniqueOK:
+            uniqueOK = True
+            uniq = dict()
+            vals = dict()
+            for k in self.question.unique:
+                u = self.question.unique[k]
+                s = ExpandString(str(u.get()),self.locals)
+                if s in uniq: uniqueOK = False
+                uniq[s] = k
+                vals[k] = s
+            if not uniqueOK:
+                self.UpdateVariables(rng=rng)
+                brake -= 1
+            if brake < 0:
+                print("Cannot find unique set of values for "
+                      + self.question.name)
+                for kk in self.question.variables:
+                    print(kk,
+                          ExpandString(str(self.question.variables[kk].get()),
+                                       self.locals))
+                for kk in self.question.constants:
+                    print(kk,
+                          ExpandString(str(self.question.constants[kk].get()),
+                                       self.locals))
+                print("Uniques ", vals)
+                raise RuntimeError("Cannot find unique values")
+        for s in uniq:
+            self.locals[uniq[s]] = s
+
+    def ValidateQuestion(self):
+        aDict = dict()
+        questionOK = True
+        # Check if there are duplicate answers for the question.
+        for answer in self.answerList:
+            txt = answer.locals["TEXT"];
+            txt = ExpandString(str(txt),answer.locals)
+            if txt in aDict:
+                questionOK = False;
+                aDict[txt].append(answer)
+            else:
+                aDict[txt] = [answer]
+        if questionOK: return questionOK
+        # The question has duplicated answers.  Check each set of
+        # duplicate answers, and if any of the set is the correct
+        # answer mark all of the set as correct.
+        for k in aDict:
+            if len(aDict[k]) < 2: continue
+            correctDuplicate = False
+            for a in aDict[k]:
+                if a.locals["ITEM"] in self.correctAnswer:
+                    correctDuplicate = True
+            if correctDuplicate:
+                for a in aDict[k]:
+                    print("Duplicate Answer",a.AnswerName(),a.locals["ITEM"])
+                    if a.locals["ITEM"] not in self.correctAnswer:
+                        self.correctAnswer += a.locals["ITEM"]
+        # There is a question with multiple correct answers
+        # (duplicates).  Flag that by marking the correct answer as
+        # lower case.  When grading any lower case answer should be
+        # considered correct. (e.g. "ab" means both a and b are
+        # correct).
+        if not questionOK and len(self.correctAnswer) > 1:
+            self.correctAnswer = self.correctAnswer.lower()
+        return questionOK
+
+    ## Build a single question for the test.
+    #
+    # This builds a template string, and then substitutes
+    #
+    # - &{NAME}  : The question name
+    # - &{NUMBER} : The question number
+    # - &{POINTS} : The number of points that this question is worth
+    # - &{TEXT}  : The question text
+    # - &{FIGURE} : The name of a figure file (pdf), or it is not defined
+    # - &{SOLUTION} : The text for the solution.
+    # - &{ANSWERS} : A string with all of the answers for this question
+    #         which is automatically built using AnswerInstance.
+    #
+    # All of the definitions from the questionInstance are also included.
+    def MakeQuestion(self) -> str:
+        question =  "%% Start Question " + self.question.name + "\n"
+        if "FIGURE" not in self.locals: question += self.exam.questionTemplate
+        else: question += self.exam.questionWithFigureTemplate
+        question += "\n"
+        question += "%% Finish Question " + self.question.name + "\n"
+        question = ExpandString(question,self.locals)
+        return question
+
+    def QuestionName(self) -> str:
+        return self.question.name
+
+    def CorrectAnswer(self) -> str:
+        return self.correctAnswer
+
+    ## The answer names in letter order separated by commas.
+    def AnswerNames(self) -> str:
+        return ",".join(a.AnswerName() for a in self.answerList)
+
+## Hold all of the information necessary to print one answer.
+class AnswerInstance(object):
+    def __init__(self, questionInstance, answer, item):
+        self.answer = answer
+        self.questionInstance = questionInstance
+        self.question = self.questionInstance.question
+        self.examInstance = self.questionInstance.examInstance
+        self.exam = self.examInstance.exam
+        self.locals = dict();
+        self.locals.update(self.questionInstance.locals)
+        self.locals["ITEM"] = item
+        self.locals["TEXT"] = self.text()
+        if self.correct(): self.locals["CORRECT"] = "Correct"
+        else: self.locals["CORRECT"] = "Wrong"
+
+    def __str__(self): return self.text()
+
+    def text(self): return str(self.answer.text)
+
+    def correct(self): return self.answer.correct
+
+    ## Build a single answer for the test.
+    #
+    # This builds a template string, and then substitutes
+    #
+    # - &{ITEM}  : The answer item (usually "A", "B", "C", etc)
+    # - &{TEXT}  : The answer text
+    # - &{CORRECT} : A string for if this is the correct answer.  It
+    #        will be "Correct" for right answers, and "Wrong" for wrong
+    #        answers.
+    #
+    # All of the definitions from the questionInstance are also included.
+    def MakeAnswer(self):
+        answer  = "%% Start answer " + self.answer.name + "\n"
+        answer += self.exam.answerTemplate + "\n"
+        answer += "%% Finish answer " + self.answer.name + "\n"
+        answer = ExpandString(answer,self.locals)
+        return answer
+
+    def AnswerName(self) -> str :
+        return self.answer.name
+
+######################################################################
+# Build the versions of the exam (possibly in parallel).
+######################################################################
+
+## Return the LaTeX for one version of the exam.
+#
+# If a `filename` is provided (usually `inst.name+".tex"`), the LaTeX
+# is written to the file as it is expanded (see StreamExam) and None
+# is returned.  The file isn't touched if it already has the same
+# contents, so the PDF files don't need to be rebuilt (see BuildPDFs).
+def render(inst, filename: str = None):
+    if filename is None: return inst.MakeExam()
+    partial = filename + ".part"
+    try:
+        with open(partial,"w") as texFile:
+            try:
+                for text in inst.StreamExam(): texFile.write(text)
+            except TemplateNotExact:
+                texFile.seek(0)
+                texFile.truncate()
+                texFile.write(inst.MakeExam())
+        if os.path.isfile(filename) and filecmp.cmp(partial,filename,False):
+            print("Version is unchanged in", filename)
+        else:
+            print("Write version to", filename)
+            os.replace(partial, filename)
+    finally:
+        if os.path.isfile(partial): os.remove(partial)
+    return None
+
+## Build, check and write one version of the exam.
+#
+# The random numbers are generated from the `seed` and the copy
+# number, so a version is the same no matter which process builds it,
+# or what order the versions are built in.  This returns a tuple of
+# the ExamInstance and a flag that is true if the version is valid.
+# The LaTeX file is written if `write` is true.
+def BuildVersion(exam, samples, seed, copy, version, options, write=True):
+    inst = ExamInstance(exam, version, copy, samples, seed,
+                        options.allQuestions)
+    valid = inst.ValidateExam()
+    if write: render(inst, inst.name+".tex")
+    return inst, valid
+
+## Return the names of the questions that can be drawn for a version.
+def DrawableQuestions(exam) -> list:
+    names = set()
+    for k, n in exam.questions.sequence:
+        if "Choices" not in n: continue
+        for choice in exam.constraints.Select(n["Choices"]):
+            names.add(choice)
+            names.update(exam.constraints.chains[choice])
+    return [name for name in exam.pool if name in names]
+
+## List the objects that belong to the Exam.
+#
+# These objects are shared by every ExamInstance, so they are not
+# copied when an ExamInstance is sent between processes.
+def SharedObjects(exam) -> list:
+    shared = [exam]
+    shared += list(exam.templates.values())
+    for d in (exam.constants, exam.variables):
+        shared += list(d.values())
+        shared += [v.value for v in d.values() if type(v) is ConstantValue]
+    for name in DrawableQuestions(exam):
+        q = exam.pool[name]
+        shared.append(q)
+        for d in (q.constants, q.variables, q.unique, q.answers):
+            shared += list(d.values())
+            shared += [v.value for v in d.values() if type(v) is ConstantValue]
+    return shared
+
+## A pickler that refers to the shared Exam objects by index.
+class SharedPickler(pickle.Pickler):
+    def __init__(self, file, shared: list):
+        super().__init__(file)
+        self.shared = {id(obj): i for i, obj in enumerate(shared)}
+
+    def persistent_id(self, obj):
+        return self.shared.get(id(obj))
+
+## An unpickler for the output of SharedPickler.
+class SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared: list):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+## An unpickler for the pickle files.
+#
+# The pickle files written before the code moved from exam-writer.py
+# refer to the classes in the `__main__` module.  They are found in
+# this module instead (whether it is imported or run as a script).
+class ExamUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str):
+        if module in ("__main__", "exam_writer"): module = __name__
+        return super().find_class(module, name)
+
+## The state of a worker process (see BuildVersionsInParallel).
+worker = dict()
+
+def InitializeWorker(exam, samples, seed, options, write):
+    worker["exam"] = exam
+    worker["samples"] = samples
+    worker["seed"] = seed
+    worker["options"] = options
+    worker["write"] = write
+    worker["shared"] = SharedObjects(exam)
+
+def BuildVersionInWorker(item):
+    copy, version = item
+    try:
+        inst, valid = BuildVersion(worker["exam"], worker["samples"],
+                                   worker["seed"], copy, version,
+                                   worker["options"], worker["write"])
+    except Exception:
+        raise
+    except BaseException as error:
+        # Only an Exception is sent back to the parent, which would
+        # otherwise wait forever for this version.
+        raise RuntimeError("Version " + str(copy) + " stopped: "
+                           + repr(error))
+    buffer = io.BytesIO()
+    SharedPickler(buffer, worker["shared"]).dump(inst)
+    return buffer.getvalue(), valid
+
+## Build the versions of the exam using a pool of `jobs` processes.
+#
+# This generates a tuple of the ExamInstance and a validity flag for
+# each version in the same order as `versions`.  The processes are
+# forked so the workers start with the Exam that is already loaded.
+def BuildVersionsInParallel(exam, samples, seed, versions, options,
+                            write=True):
+    shared = SharedObjects(exam)
+    context = multiprocessing.get_context("fork")
+    with context.Pool(options.jobs, initializer=InitializeWorker,
+                      initargs=(exam, samples, seed, options, write)) as pool:
+        for data, valid in pool.imap(BuildVersionInWorker, versions):
+            inst = SharedUnpickler(io.BytesIO(data), shared).load()
+            yield inst, valid
+
+######################################################################
+# The binary answer key.
+#
+# The key is also written in a compact columnar form (BaseName.key.bin)
+# for the grader.  All of the numbers are little endian, and each
+# array starts on a four byte boundary so the file can be memory
+# mapped (e.g. with numpy.memmap).
+#
+# - magic: 8 bytes "EXAMKEY\x01"
+# - counts: uint32[4] with the copies (C), the questions per copy (Q),
+#       the strings (S), and the bytes of string data (B)
+# - offsets: int32[S+1] with the start of each string in the data
+# - data: B bytes of UTF-8 string data (padded to four bytes)
+# - fields: int32[C,4] with the string index of the LASTNAME, FIRSTNAME,
+#       SID and Basename for each copy
+# - questions: int32[C,Q] with the string index of each question name
+#       (-1 when the copy has fewer questions)
+# - correct: uint32[C,Q] with a bit set for each correct letter (A is
+#       bit 0)
+# - exact: uint8[C,Q] which is 1 if the answer must match exactly, and
+#       0 if any of the correct letters is right (a lower case key)
+######################################################################
+
+BINARY_KEY_MAGIC = b"EXAMKEY\x01"
+
+## Return the binary answer key for a list of ExamInstance objects.
+def MakeBinaryKey(exams: list) -> bytes:
+    strings = dict()
+    def Intern(value): return strings.setdefault(str(value), len(strings))
+    width = max(len(inst.questionList) for inst in exams)
+    fields = array.array("i")
+    questions = array.array("i")
+    correct = array.array("I")
+    exact = array.array("B")
+    for inst in exams:
+        for k in ("LASTNAME", "FIRSTNAME", "SID"):
+            fields.append(Intern(inst.version.get(k,"")))
+        fields.append(Intern(inst.name))
+        for q in inst.questionList:
+            answer = q.CorrectAnswer()
+            mask = 0
+            for c in answer.upper(): mask |= 1 << (ord(c) - ord("A"))
+            questions.append(Intern(q.QuestionName()))
+            correct.append(mask)
+            exact.append(answer != answer.lower())
+        for i in range(len(inst.questionList), width):
+            questions.append(-1)
+            correct.append(0)
+            exact.append(0)
+    offsets = array.array("i", [0])
+    encoded = [k.encode("utf-8") for k in strings]
+    for value in encoded: offsets.append(offsets[-1] + len(value))
+    data = b"".join(encoded)
+    data += b"\0" * (-len(data) % 4)
+    counts = array.array("I", [len(exams), width, len(strings),
+                               offsets[-1]])
+    output = [BINARY_KEY_MAGIC]
+    for values in (counts, offsets, data, fields, questions, correct, exact):
+        if type(values) is bytes:
+            output.append(values)
+            continue
+        if sys.byteorder == "big": values.byteswap()
+        output.append(values.tobytes())
+    return b"".join(output)
+
+######################################################################
+# Build the PDF files for the exam with pdflatex.
+#
+# Each copy has a solution PDF (BaseName-NNNN-soln.pdf) and a student
+# PDF (BaseName-NNNN.pdf).  Each PDF is compiled in its own scratch
+# directory so they can be built at the same time, and a PDF is only
+# rebuilt when it is older than the LaTeX file or one of the figures.
+######################################################################
+
+## Return the figure files used by one version of the exam.
+def FigureFiles(inst) -> list:
+    figures = []
+    for q in inst.questionList:
+        if q.question.figure is None: continue
+        figures += [q.question.figure, q.question.figure + ".pdf"]
+    return figures
+
+## Return true if the PDF file is newer than all of the input files.
+def PDFUpToDate(pdf: str, inputs: list) -> bool:
+    if not os.path.isfile(pdf): return False
+    built = os.path.getmtime(pdf)
+    for name in inputs:
+        if os.path.isfile(name) and os.path.getmtime(name) > built:
+            return False
+    return True
+
+## Return true if LaTeX needs another pass to fix the references.
+def NeedsRerun(aux: str, log: str) -> bool:
+    if os.path.isfile(aux):
+        with io.open(aux,"r",encoding="ascii",errors="ignore") as f:
+            for line in f:
+                if line.startswith(("\\newlabel","\\bibcite","\\@writefile")):
+                    return True
+    if os.path.isfile(log):
+        with io.open(log,"r",encoding="ascii",errors="ignore") as f:
+            if "Rerun to get" in f.read(): return True
+    return False
+
+## Run pdflatex in a scratch directory.
+#
+# The output files are named after `jobname` and written to `scratch`.
+# If LaTeX fails, the end of the log is printed and this returns false.
+def RunLaTeX(arguments: list, scratch: str, jobname: str, target: str) -> bool:
+    command = ["pdflatex", "-interaction=nonstopmode", "-halt-on-error",
+               "-output-directory", scratch, "-jobname", jobname]
+    result = subprocess.run(command + arguments, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.STDOUT)
+    if result.returncode == 0: return True
+    print("LaTeX failed for", target)
+    log = os.path.join(scratch, jobname+".log")
+    if os.path.isfile(log):
+        with io.open(log,"r",encoding="ascii",errors="ignore") as f:
+            print("".join(f.readlines()[-20:]))
+    return False
+
+## Build the shared preamble format for an exam.
+#
+# The shared preamble is written to BaseName-preamble.tex and dumped
+# into BaseName.fmt with mylatexformat.  The format is only rebuilt
+# when the preamble changes.  This returns the name of the format (to
+# be used with -fmt), or None if there isn't a format.
+def BuildFormat(exam) -> str:
+    shared = getattr(exam,"preamble","")
+    if not shared: return None
+    base = str(exam.baseName)
+    source = base + "-preamble.tex"
+    fmt = base + ".fmt"
+    text = shared + FORMAT_DUMP_MARK
+    current = None
+    if os.path.isfile(source):
+        with open(source,"r") as f: current = f.read()
+    if current != text:
+        with open(source,"w") as f: f.write(text)
+    if PDFUpToDate(fmt, [source]): return os.path.abspath(base)
+    print("Build shared preamble format", fmt)
+    jobname = os.path.basename(base)
+    with tempfile.TemporaryDirectory(prefix=".latex-"+jobname+"-",
+                                     dir=os.path.dirname(fmt) or ".") as scratch:
+        arguments = ["-ini", "&pdflatex", "mylatexformat.ltx", source]
+        if not RunLaTeX(arguments, scratch, jobname, fmt):
+            print("Building PDF files without the shared preamble")
+            return None
+        os.replace(os.path.join(scratch, jobname+".fmt"), fmt)
+    return os.path.abspath(base)
+
+## Compile one PDF file.
+#
+# The LaTeX file `tex` is compiled to `pdf`.  If `solutions` is true,
+# then \printSolutions is defined so the solutions are included.  If
+# `fmt` is provided, the shared preamble is loaded from that format.
+# The second pass is only run when the first pass needs it.  This
+# returns true if the PDF was built.
+def CompilePDF(tex: str, pdf: str, solutions: bool, fmt: str = None) -> bool:
+    jobname = os.path.splitext(os.path.basename(pdf))[0]
+    source = "\\input{" + tex + "}"
+    if solutions: source = "\\def\\printSolutions{}" + source
+    arguments = [source]
+    if fmt: arguments = ["-fmt", fmt] + arguments
+    directory = os.path.dirname(pdf) or "."
+    with tempfile.TemporaryDirectory(prefix=".latex-"+jobname+"-",
+                                     dir=directory) as scratch:
+        aux = os.path.join(scratch, jobname+".aux")
+        log = os.path.join(scratch, jobname+".log")
+        for latexPass in range(2):
+            if not RunLaTeX(arguments, scratch, jobname, pdf): return False
+            if not NeedsRerun(aux, log): break
+        os.replace(os.path.join(scratch, jobname+".pdf"), pdf)
+    return True
+
+## Build the PDF files for a list of ExamInstance objects.
+#
+# The PDF files are built using `jobs` parallel pdflatex processes.
+# The copies that mark the end of the shared preamble are compiled
+# using the shared format.  This returns the number of PDF files that
+# could not be built.
+def BuildPDFs(exams: list, jobs: int) -> int:
+    if shutil.which("pdflatex") is None:
+        print("Cannot build PDF files: pdflatex was not found")
+        return 2*len(exams)
+    fmt = BuildFormat(exams[0].exam)
+    tasks = []
+    for inst in exams:
+        tex = inst.name + ".tex"
+        inputs = [tex] + FigureFiles(inst)
+        useFormat = None
+        if fmt:
+            with open(tex,"r") as f:
+                if FORMAT_DUMP_MARK in f.read():
+                    useFormat = fmt
+                    inputs.append(fmt + ".fmt")
+        for pdf, solutions in ((inst.name + "-soln.pdf", True),
+                               (inst.name + ".pdf", False)):
+            if PDFUpToDate(pdf, inputs): continue
+            tasks.append((tex, pdf, solutions, useFormat))
+    print("Building", len(tasks), "PDF files")
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max(jobs,1)) as pool:
+        results = pool.map(lambda task: CompilePDF(*task), tasks)
+        for task, ok in zip(tasks, results):
+            if ok: print("Wrote PDF to", task[1])
+            else: failed += 1
+    return failed
+
+######################################################################
+# The build cache.
+#
+# The cache is saved next to the pickle file.  It records the seed, a
+# digest of everything that is shared by all of the versions, and for
+# each copy, the names of the chosen questions and a digest of the
+# version fields and of those questions.  When the exam is built again
+# with the same seed, only the copies with a changed digest are
+# rebuilt.  The other copies are taken from the pickle file, and their
+# LaTeX files are not rewritten.
+######################################################################
+
+## Return a digest of a value that can be written as JSON.
+def Digest(value) -> str:
+    text = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+## Return a digest of everything shared by the versions of the exam.
+#
+# This includes the templates, constants and variables, how the
+# questions are chosen and ordered, the options changing the output,
+# and this script.
+def ExamDigest(exam, allQuestions: bool = False) -> str:
+    blocks = []
+    for block in exam.configuration:
+        if "Question" in block or "Versions" in block: continue
+        if "Questions" in block: continue
+        blocks.append(block)
+    structure = [exam.questions.sequence]
+    for k in exam.pool:
+        q = exam.pool.index[k]
+        structure.append([k, q.index, q.before, q.after, q.follows])
+    with open(__file__,"rb") as f: script = hashlib.sha1(f.read()).hexdigest()
+    return Digest([blocks, structure, script, allQuestions])
+
+## Return a digest of the inputs for one copy of the exam.
+#
+# The `names` are the questions chosen for the copy.  An empty string
+# is returned if a question isn't in the pool.
+def CopyDigest(exam, version: dict, names: list) -> str:
+    questions = []
+    for name in names:
+        if name not in exam.pool: return ""
+        questions.append(exam.pool.index[name].digest)
+    return Digest([version, questions])
+
+## Read the build cache (or return None if it can't be read).
+def ReadBuildCache(filename: str):
+    if not os.path.isfile(filename): return None
+    try:
+        with open(filename,"r") as f: return json.load(f)
+    except:
+        print("Ignoring bad build cache", filename)
+        return None
+
+## Write the build cache for a list of ExamInstance objects.
+def WriteBuildCache(filename: str, seed, digest: str, exams: list,
+                    valid: dict) -> None:
+    copies = dict()
+    for inst in exams:
+        names = [q.QuestionName() for q in inst.questionList]
+        copies[str(inst.copy)] = {
+            "digest": CopyDigest(inst.exam, inst.version, names),
+            "questions": names,
+            "valid": valid[inst.copy],
+        }
+    print("Write build cache to", filename)
+    with open(filename,"w") as f:
+        json.dump({"seed": seed, "exam": digest, "copies": copies}, f,
+                  indent=1)
+
+## Point an ExamInstance read from a pickle at a new Exam object.
+#
+# This is used when a cached copy is reused, so that the new pickle
+# file only holds one copy of the Exam.
+def ReattachVersion(inst, exam) -> None:
+    inst.exam = exam
+    for q in inst.questionList:
+        q.exam = exam
+        q.question = exam.pool[q.question.name]
+        for a in q.answerList:
+            a.exam = exam
+            a.question = q.question
+            a.answer = q.question.answers[a.answer.name]
+
+######################################################################
+# The library interface.  The exam can be loaded once, and then used
+# to generate any number of sets of versions in the same process.
+######################################################################
+
+## The exams that have been loaded (see load_exam).
+loadedExams = dict()
+
+## Read the exam description from a YAML file.
+#
+# The Exam is kept, and is returned again when the same file is loaded
+# (from the same directory) as long as none of the included files, or
+# the versions CSV files, has changed.  The `options` come from
+# ExamOptions (the defaults are used if it is None).
+def load_exam(filename: str, options = None):
+    if options is None: options = ExamOptions()
+    key = (os.getcwd(), filename)
+    exam = loadedExams.get(key)
+    if (exam is not None and not options.force
+        and not options.dumpInput and not options.dumpYAML
+        and exam.includesUnchanged(exam.includes)
+        and exam.dataUnchanged()):
+        print("Using loaded exam", filename)
+        return exam
+    exam = Exam(filename, options)
+    loadedExams[key] = exam
+    return exam
+
+## Build the versions of an exam.
+#
+# This returns a tuple of the list of ExamInstance objects and the
+# number of invalid versions.  If `write` is true (and it isn't a dry
+# run), the LaTeX file for each version is written (see render), and
+# the build cache and pickle file are updated (unless only one copy is
+# rebuilt).  Otherwise nothing is written, and the versions can be
+# written with render and write_key.  The copies that haven't changed
+# since the last build are reused either way.  The seed, jobs, and
+# which copies are built come from the `options` (see ExamOptions).
+def generate_versions(exam, options = None, write = True):
+    if options is None: options = ExamOptions()
+    write = write and not options.dryRun
+    exams = []
+    invalidExam = 0
+
+    # Read the cache from the last build.
+    cache = None
+    cacheName = exam.baseName+".cache"
+    incremental = not (options.force or options.oneVersion
+                       or options.onlyCopy)
+    if incremental: cache = ReadBuildCache(cacheName)
+
+    # The seed used to derive the random numbers for each copy.  It is
+    # saved in the key so that any copy can be rebuilt.
+    seed = options.seed
+    if seed is None and cache is not None: seed = cache["seed"]
+    if seed is None and options.onlyCopy:
+        seed = ReadKeySeed(exam.baseName+".key")
+        if seed is None: raise ValueError("Need --seed to rebuild a copy")
+    if seed is None: seed = random.getrandbits(32)
+    print("Random seed", seed)
+
+    versions = list(enumerate(exam.versions.inputs,1))
+    if options.onlyCopy:
+        versions = versions[options.onlyCopy-1:options.onlyCopy]
+    elif options.oneVersion: versions = versions[:1]
+
+    # Draw the random variables for all of the versions at once.
+    count = 0
+    if versions: count = versions[-1][0]
+    samples = VariableSamples(exam, count, seed)
+
+    # Find the copies that can be reused from the last build.
+    examDigest = ExamDigest(exam, options.allQuestions)
+    reused = dict()
+    if (cache is not None and cache["seed"] == seed
+        and cache["exam"] == examDigest
+        and os.path.isfile(exam.baseName+".pickle")):
+        with open(exam.baseName+".pickle", "rb") as file:
+            previous = {inst.copy: inst
+                        for inst in ExamUnpickler(file).load()}
+        for copy, version in versions:
+            entry = cache["copies"].get(str(copy))
+            if entry is None or copy not in previous: continue
+            if not os.path.isfile(previous[copy].name+".tex"): continue
+            if entry["digest"] != CopyDigest(exam,version,entry["questions"]):
+                continue
+            ReattachVersion(previous[copy], exam)
+            reused[copy] = (previous[copy], entry["valid"])
+    stale = [(copy, version) for copy, version in versions
+             if copy not in reused]
+    print("Rebuilding", len(stale), "of", len(versions), "versions")
+
+    if options.jobs > 1 and len(stale) > 1:
+        results = BuildVersionsInParallel(exam, samples, seed, stale,
+                                          options, write)
+    else:
+        results = (BuildVersion(exam, samples, seed, copy, version, options,
+                                write)
+                   for copy, version in stale)
+    for inst, valid in results: reused[inst.copy] = (inst, valid)
+
+    validity = dict()
+    for copy, version in versions:
+        inst, valid = reused[copy]
+        if not valid: invalidExam += 1
+        validity[copy] = valid
+        exams.append(inst)
+
+    # Save the pickle (but not if only one copy was rebuilt).
+    if exams and write and not options.onlyCopy:
+        filename = exam.baseName+".pickle"
+        print("Pickle to", filename)
+        with open(filename,"wb") as file: pickle.dump(exams,file)
+        if incremental:
+            WriteBuildCache(cacheName, seed, examDigest, exams, validity)
+
+    return exams, invalidExam
+
+## Write the answer keys for a list of ExamInstance objects.
+#
+# This writes the CSV key (BaseName.key), the binary key
+# (BaseName.key.bin) and the answer names for each letter
+# (BaseName.choices) used by the grader.
+def write_key(exams: list) -> None:
+    key = exams[0].MakeKey(True)
+    for inst in exams: key += inst.MakeKey()
+    filename = exams[0].exam.baseName+".key"
+    print("Write answer key to", filename)
+    with open(filename,"w") as file: file.write(key)
+    filename = exams[0].exam.baseName+".key.bin"
+    print("Write binary answer key to", filename)
+    with open(filename,"wb") as file: file.write(MakeBinaryKey(exams))
+    # The answer name for each letter, used by the grader.
+    filename = exams[0].exam.baseName+".choices"
+    print("Write answer choices to", filename)
+    with open(filename,"w") as file:
+        file.write(exams[0].MakeChoices(True))
+        for inst in exams: file.write(inst.MakeChoices())
+
+######################################################################
+# Watch the input files and rebuild the exam when they change.
+######################################################################
+
+## How often the input files are checked (in seconds).
+WATCH_INTERVAL = 0.5
+
+## Return the (mtime, size) of each file (or None if it is missing).
+def FileStatus(names) -> dict:
+    status = dict()
+    for name in names:
+        try:
+            info = os.stat(name)
+            status[name] = (info.st_mtime, info.st_size)
+        except OSError:
+            status[name] = None
+    return status
+
+## Rebuild the versions of an exam whenever the input files change.
+#
+# The Exam stays loaded between builds.  When one of the YAML files (or
+# the versions CSV file) changes, the exam is read again (see
+# load_exam) and the questions that didn't change are reused, then only
+# the copies that changed are rebuilt (see generate_versions), or only
+# the `onlyCopy` preview.
+# When only a figure changes, just the PDF files are rebuilt.  This
+# runs until it is interrupted.
+def WatchExam(filename: str, options) -> None:
+    exam = None
+    exams = []
+    sources = dict()
+    figures = dict()
+    rebuild = True
+    try:
+        while True:
+            if rebuild:
+                try:
+                    previous = exam
+                    exam = load_exam(filename, options)
+                    if previous is not None and exam is not previous:
+                        exam.pool.reuse(previous.pool)
+                    exams, invalidExam = generate_versions(exam, options)
+                    FinishVersions(exams, invalidExam, options)
+                except Exception as error:
+                    print("Could not build exam:", error)
+            elif exams:
+                failedPDF = BuildPDFs(exams, options.jobs)
+                if failedPDF > 0:
+                    print("WARNING: Could not build",failedPDF,"PDF files")
+            # Until the exam has been read, only the top file is known.
+            names = [filename]
+            if exam is not None:
+                names = [include[1] for include in exam.includes]
+                names += list(exam.dataFiles)
+            sources = FileStatus(names)
+            figureNames = set()
+            if options.pdf:
+                for inst in exams: figureNames.update(FigureFiles(inst))
+            figures = FileStatus(sorted(figureNames))
+            print("Watching", len(sources), "input files and",
+                  len(figures), "figure files")
+            while (FileStatus(sources) == sources
+                   and FileStatus(figures) == figures):
+                time.sleep(WATCH_INTERVAL)
+            rebuild = FileStatus(sources) != sources
+    except KeyboardInterrupt:
+        print("Stop watching", filename)
+
+######################################################################
+# The main code begins here.
+
+## Write the answer keys and PDF files, and report any problems.
+def FinishVersions(exams: list, invalidExam: int, options) -> None:
+    # Write the answer keys (but not if only one copy was rebuilt, or
+    # if the PDF files are being built from the pickle file).
+    if (not options.dryRun and not options.onlyCopy
+        and not (options.pickle and options.pdf)):
+        write_key(exams)
+
+    # Build the PDF files.
+    if options.pdf and not options.dryRun:
+        failedPDF = BuildPDFs(exams, options.jobs)
+        if failedPDF > 0:
+            print("WARNING: Could not build",failedPDF,"PDF files")
+
+    if invalidExam > 0:
+        print("WARNING: Invalid question on",invalidExam,"exams")
+
+def main() -> None:
+    options = parser.parse_args()
+
+    if options.watch:
+        if options.pickle: parser.error("--watch needs the YAML file")
+        WatchExam(options.file[0], options)
+        return
+
+    if not options.pickle:
+        # Read the exam description from a YAML file and generate the
+        # exams
+        exam = load_exam(options.file[0], options)
+        exams, invalidExam = generate_versions(exam, options)
+    else:
+        # Read an existing exam from a PICKLE file
+        with open(options.file[0], "rb") as file:
+            exams = ExamUnpickler(file).load()
+
+        # Print each copy of the exam.  With --pdf, the LaTeX files
+        # that exist are compiled as they are (they might have been
+        # edited by hand).
+        invalidExam = 0
+        for inst in exams:
+            if not inst.ValidateExam(): invalidExam += 1
+            filename = inst.name+".tex"
+            if options.dryRun: continue
+            if options.pdf and os.path.isfile(filename): continue
+            render(inst, filename)
+
+    if len(exams) < 1:
+        print("No exams generated")
+        sys.exit(1)
+
+    FinishVersions(exams, invalidExam, options)
+
+if __name__ == "__main__": main()
+
+# A GPL3 License
+#
+# Copyright 2022 Clark McGrew
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see
+# <https://www.gnu.org/licenses/>.
+
+############################################################################
+# End of exam-writer
+############################################################################
@@ -0,0 +1,25 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+## The grader is a script that grades when it is loaded, so it is
+## loaded with an empty manifest (which grades nothing).
+@pytest.fixture(scope="session")
+def grader(tmp_path_factory):
+    manifest = tmp_path_factory.mktemp("grader") / "manifest.csv"
+    manifest.write_text("Roster,Key,Answers,Results\n")
+    spec = importlib.util.spec_from_file_location(
+        "exam_grader", os.path.join(ROOT, "exam-grader.py"))
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = ["exam-grader.py", "-m", str(manifest)]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import pytest
+
+import exam_writer
+
+from conftest import ROOT
+
+## Build the versions of the sample exam, and write the keys.
+@pytest.fixture
+def keyFile(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(ROOT, "samples", "sample-test.yaml"), tmp_path)
+    options = exam_writer.ExamOptions(seed=12345)
+    exam = exam_writer.load_exam("sample-test.yaml", options)
+    exams, invalid = exam_writer.generate_versions(exam, options,
+                                                   write=False)
+    exam_writer.write_key(exams)
+    return str(tmp_path / (exam.baseName + ".key"))
+
+def test_round_trip(grader, keyFile):
+    text = grader.ExamKey()
+    text.ReadFile(keyFile)
+    binary = grader.ExamKey()
+    binary.ReadBinary(keyFile + ".bin")
+    assert len(binary.student) == len(text.student) > 0
+    for b, t in zip(binary.student, text.student):
+        for field in ("LASTNAME", "FIRSTNAME", "SID", "Basename"):
+            assert b[field] == t[field]
+        # The CSV key ends with an empty question, which never scores.
+        assert t["Matcher"][-1] == ("", False, 0)
+        assert b["Matcher"] == t["Matcher"][:-1]
+
+def test_bad_magic(grader, keyFile):
+    with open(keyFile + ".bin", "r+b") as f: f.write(b"NOTAKEY!")
+    with pytest.raises(RuntimeError):
+        grader.ExamKey().ReadBinary(keyFile + ".bin")
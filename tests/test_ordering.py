@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import exam_writer
+
+## A pool entry with only the ordering fields.
+class Entry(object):
+    def __init__(self, follows=None, before=None, after=None):
+        self.follows = follows
+        self.before = before
+        self.after = after
+
+def MakePool():
+    return {
+        "Intro": Entry(before="all"),
+        "Q1": Entry(),
+        "Q1a": Entry(follows="Q1"),
+        "Q1b": Entry(follows="Q1a"),
+        "Q2": Entry(before="Q3"),
+        "Q3": Entry(),
+        "Q4": Entry(after="Q3"),
+        "Last": Entry(after="all"),
+    }
+
+def test_sort_keeps_order_without_constraints():
+    ordered = ["c", "a", "b"]
+    before = {c: set() for c in ordered}
+    assert exam_writer.SortChosen(ordered, before) == ordered
+
+def test_sort_moves_only_what_it_must():
+    ordered = ["d", "c", "b", "a"]
+    before = {"a": {"c"}, "b": set(), "c": set(), "d": set()}
+    assert exam_writer.SortChosen(ordered, before) == ["d", "b", "a", "c"]
+
+def test_sort_ignores_names_not_chosen():
+    before = {"a": {"x"}, "b": set()}
+    assert exam_writer.SortChosen(["b", "a"], before) == ["b", "a"]
+
+def test_sort_cycle():
+    before = {"a": {"b"}, "b": {"a"}}
+    with pytest.raises(ValueError):
+        exam_writer.SortChosen(["a", "b"], before)
+
+def test_constraint_index():
+    index = exam_writer.ConstraintIndex(MakePool())
+    assert index.chains["Q1"] == ["Q1a", "Q1b"]
+    assert index.chains["Q1a"] == ["Q1b"]
+    assert index.chains["Q2"] == []
+    assert "Q3" in index.successors["Q2"]
+    assert "Q4" in index.successors["Q3"]
+    assert "Q1a" not in index.successors["Intro"]
+    assert "Q1" in index.successors["Intro"]
+    assert "Last" in index.successors["Q1"]
+    assert "Q1a" not in index.Select("all")
+    assert index.Select(["Q[12]", "Q4"]) == ["Q1", "Q2", "Q4"]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_order_chosen(seed):
+    pool = MakePool()
+    index = exam_writer.ConstraintIndex(pool)
+    rng = random.Random(seed)
+    chosen = exam_writer.ChooseFromPool(pool, "all", rng=rng, index=index)
+    assert sorted(chosen) == sorted(pool)
+    out = exam_writer.OrderChosen(chosen, pool, rng, index)
+    assert sorted(out) == sorted(pool)
+    position = {c: i for i, c in enumerate(out)}
+    assert out[0] == "Intro" and out[-1] == "Last"
+    assert position["Q2"] < position["Q3"] < position["Q4"]
+    i = position["Q1"]
+    assert out[i:i+3] == ["Q1", "Q1a", "Q1b"]
+
+def test_choose_keeps_chains_together():
+    pool = MakePool()
+    index = exam_writer.ConstraintIndex(pool)
+    for seed in range(20):
+        rng = random.Random(seed)
+        chosen = exam_writer.ChooseFromPool(pool, "all", 4, rng, index)
+        assert len(chosen) <= 4
+        if "Q1" in chosen:
+            i = chosen.index("Q1")
+            assert chosen[i:i+3] == ["Q1", "Q1a", "Q1b"]
+        else:
+            assert "Q1a" not in chosen and "Q1b" not in chosen
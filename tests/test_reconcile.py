@@ -0,0 +1,69 @@
+import itertools
+import random
+
+import pytest
+
+def Student(sid, last, first):
+    return {"SID": sid, "LASTNAME": last, "FIRSTNAME": first}
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("", "", 0), ("", "abc", 3), ("kitten", "sitting", 3),
+    ("123456789", "123456789", 0), ("123456789", "123456780", 1),
+    ("123456789", "213456789", 2), ("12345678", "123456789", 1),
+])
+def test_edit_distance(grader, a, b, distance):
+    assert grader.EditDistance(a, b) == distance
+    assert grader.EditDistance(b, a) == distance
+
+def test_bktree_matches_brute_force(grader):
+    rng = random.Random(1)
+    words = ["".join(rng.choice("0123") for i in range(rng.randint(3, 6)))
+             for i in range(200)]
+    tree = grader.BKTree()
+    for i, word in enumerate(words): tree.Add(word, i)
+    for word, limit in itertools.product(words[:20] + ["", "0123"], (0, 1, 2)):
+        expected = sorted((grader.EditDistance(word, w), i)
+                          for i, w in enumerate(words)
+                          if grader.EditDistance(word, w) <= limit)
+        assert sorted(tree.Find(word, limit)) == expected
+
+def test_empty_tree(grader):
+    assert grader.BKTree().Find("123", 2) == []
+
+def test_reconcile(grader):
+    Scan = grader.AnswerScan
+    students = [Student("100000001", "Doe", "Jane"),
+                Student("200000002", "Roe", "Rick"),
+                Student("300000003", "Poe", "Edgar"),
+                Student("400000004", "Nobody", "Here")]
+    scans = [Scan("Doe", "Jane", "100000071", ()),       # Two SID edits.
+             Scan("R.oe", "rick", "999999999", ()),      # Only the name.
+             Scan("Smith", "Edgar", "300000004", ()),    # One SID edit.
+             Scan("Other", "Person", "555555555", ())]
+    matches = grader.ReconcileScans(students, scans)
+    assert matches[id(students[0])] is scans[0]
+    assert matches[id(students[1])] is scans[1]
+    assert matches[id(students[2])] is scans[2]
+    assert id(students[3]) not in matches
+
+def test_reconcile_needs_a_name_for_far_sids(grader):
+    Scan = grader.AnswerScan
+    students = [Student("100000001", "Doe", "Jane")]
+    scans = [Scan("Smith", "John", "100000099", ())]
+    assert grader.ReconcileScans(students, scans) == {}
+
+def test_reconcile_skips_ambiguous(grader):
+    Scan = grader.AnswerScan
+    students = [Student("100000001", "Doe", "Jane")]
+    scans = [Scan("Doe", "Jane", "100000002", ()),
+             Scan("Doe", "Jane", "100000003", ())]
+    assert grader.ReconcileScans(students, scans) == {}
+
+def test_reconcile_uses_a_scan_once(grader):
+    Scan = grader.AnswerScan
+    students = [Student("100000001", "Doe", "Jane"),
+                Student("100000002", "Doe", "John")]
+    scans = [Scan("Doe", "Jane", "100000003", ())]
+    matches = grader.ReconcileScans(students, scans)
+    assert list(matches.values()) == [scans[0]]
+    assert id(students[0]) in matches
@@ -0,0 +1,69 @@
+import pytest
+
+## A small scan file for each of the SCAN_PROFILES.  The answers are
+## (last name, first name, SID, answers).
+STUDENTS = [("Doe", "Jane", "1001", ("A", "BC", "")),
+            ("Roe", "Rick", "1002", ("D", "A", "E"))]
+
+def OpscanFile(delimiter):
+    lines = ["Exam scanned on Monday", "",
+             delimiter.join(["Last Name", "First Name", "Student ID",
+                             "1", "2", "3"])]
+    for last, first, sid, answers in STUDENTS:
+        lines.append(delimiter.join([last, first, sid] + list(answers)))
+    return "\n".join(lines) + "\n"
+
+def ScantronFile(delimiter):
+    lines = [delimiter.join(["ID", "Q1", "Q2", "Q3", "Last", "First",
+                             "Score"])]
+    for last, first, sid, answers in STUDENTS:
+        lines.append(delimiter.join([sid] + list(answers)
+                                    + [last, first, "0"]))
+    return "\n".join(lines) + "\n"
+
+def ZipgradeFile(delimiter):
+    lines = [delimiter.join(["Quiz Name", "First Name", "Last Name",
+                             "External Id", "Stu1", "Stu2", "Stu3",
+                             "PriKey1"])]
+    for last, first, sid, answers in STUDENTS:
+        lines.append(delimiter.join(["Quiz", first, last, sid]
+                                    + [a.lower() for a in answers] + ["A"]))
+    return "\n".join(lines) + "\n"
+
+FILES = {"opscan": (OpscanFile, 2),
+         "scantron": (ScantronFile, 0),
+         "zipgrade": (ZipgradeFile, 0)}
+
+@pytest.mark.parametrize("delimiter", [",", "\t", ";"])
+@pytest.mark.parametrize("profile", sorted(FILES))
+def test_sniff(grader, profile, delimiter):
+    make, skip = FILES[profile]
+    layout = grader.SniffScanLayout(make(delimiter))
+    assert layout.profile == profile
+    assert layout.delimiter == delimiter
+    assert layout.skip == skip
+    assert len(layout.answers) == 3
+
+@pytest.mark.parametrize("profile", sorted(FILES))
+def test_read(grader, tmp_path, profile):
+    make, skip = FILES[profile]
+    answerFile = tmp_path / "answers.csv"
+    answerFile.write_text(make(","))
+    answers = grader.ExamAnswers()
+    scans = list(answers.ReadFile(str(answerFile)))
+    assert answers.count == len(STUDENTS)
+    for scan, (last, first, sid, expected) in zip(scans, STUDENTS):
+        assert (scan.lastname, scan.firstname, scan.sid) == (last, first, sid)
+        assert scan.answers == expected
+
+def test_unknown_header(grader, tmp_path):
+    assert grader.SniffScanLayout("Name,Score\nDoe,10\n") is None
+    answerFile = tmp_path / "answers.csv"
+    answerFile.write_text("Name,Score\nDoe,10\n")
+    with pytest.raises(RuntimeError):
+        list(grader.ExamAnswers().ReadFile(str(answerFile)))
+
+def test_sample_stops_at_complete_line(grader):
+    text = OpscanFile(",")
+    layout = grader.SniffScanLayout(text[:text.index("Last Name") + 20])
+    assert layout is None
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+import exam_writer
+
+## Expand the string the way ExpandStringSlowly does, but give up
+## (return None) if the substitutions don't settle down (or keep
+## growing).  A bad expression gives the RuntimeError class.
+def ExpandReference(text, d, passes=50):
+    value = text
+    for i in range(passes):
+        result = value
+        value = exam_writer.ExpandTemplate(value).safe_substitute(d)
+        if value == result: break
+        if len(value) > 10000: return None
+    else:
+        return None
+    return Expand(exam_writer.ExpandStringSlowly, value, d)
+
+def Expand(expand, text, d):
+    try:
+        return expand(text, d)
+    except RuntimeError:
+        return RuntimeError
+
+@pytest.mark.parametrize("text, d", [
+    ("plain text", {}),
+    ("&{a} and &b", {"a": "1", "b": "2"}),
+    ("&{a}2", {"a": "&c", "c": "1"}),
+    ("&{a}2", {"a": "&c", "c": "1", "c2": "3"}),
+    ("x&{b}y", {"b": "&{b}"}),
+    ("&{a}", {"a": "&a&c2", "c2": ""}),
+    ("@[2]{3.14159} @{&{a}+1}", {"a": "2"}),
+    ("&&{a} &&a &", {"a": "1"}),
+    ("&{missing} &missing", {}),
+])
+def test_examples(text, d):
+    expected = ExpandReference(text, d)
+    assert Expand(exam_writer.ExpandString, text, d) == expected
+
+def test_random_templates():
+    tokens = ["&{a}", "&{b}", "&{c}", "&a", "&c", "&c2", "@{1+2}",
+              "@[2]{3.14159}", "{", "}", "&&", "x", "2", "&", "@", "@{",
+              " ", "_"]
+    rng = random.Random(1)
+    def Make(n):
+        return "".join(rng.choice(tokens) for i in range(rng.randint(0, n)))
+    checked = 0
+    for trial in range(2000):
+        text = Make(6)
+        d = {"a": Make(3), "b": Make(3), "c": Make(2), "c2": Make(1)}
+        expected = ExpandReference(text, d)
+        if expected is None: continue
+        result = Expand(exam_writer.ExpandString, text, d)
+        assert result == expected, (text, d)
+        checked = checked + 1
+    assert checked > 1500